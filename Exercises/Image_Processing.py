@@ -1,9 +1,18 @@
 from queue import Empty
+import sys
+from os.path import dirname, join, realpath
 import matplotlib.pyplot as plt
 import numpy as np
 import skimage
 import cv2
 
+APP_ROOT = join(dirname(realpath(__file__)), "..", "app")
+if APP_ROOT not in sys.path:
+    sys.path.append(APP_ROOT)
+
+import preprocessing
+from preprocessing import FramePreprocessor
+
 
 def display_image(im, title=None):
     plt.imshow(im, cmap="gray")
@@ -16,14 +25,7 @@ def display_image(im, title=None):
 
 
 def get_channel(image, channel):
-    imageNew = np.copy(image)
-
-    for i in range(0, image.shape[0]):
-        for j in range(0, image.shape[1]):
-            for k in (0, 1, 2):
-                if not k == channel:
-                    imageNew[i][j][k] = 0
-    return imageNew
+    return preprocessing.get_channel(image, channel)
 
 
 def exercise_one():
@@ -73,13 +75,12 @@ def exercise_two():
 
 def exercise_four():
     cap = cv2.VideoCapture(0)  # Enable default camera
+    preprocessor = FramePreprocessor()  # Reuses its buffers for every frame
     while True:
         success, img = cap.read()  # Read frame
 
-        result = cv2.Canny(img, 100, 200)
-
-        mask = result == 1
-        img[mask] = np.array([0, 0, 0])
+        preprocessor.canny(preprocessor.grayscale(img), 100, 200)
+        preprocessor.paint_edges(img, (0, 0, 0))
 
         cv2.imshow("Video", img)  # Display image in window
         if cv2.waitKey(10) & 0xFF == ord(
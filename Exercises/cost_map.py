@@ -0,0 +1,299 @@
+"""
+Path planning around no-fly zones, masts and terrain, with cost maps cached on disk.
+
+    python cost_map.py --start 55.3714 10.4328 --end 55.3659 10.424 --no-fly zones.geojson --fly
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sys
+from os.path import dirname, join, realpath
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+APP_ROOT = join(dirname(realpath(__file__)), "..", "app")
+if APP_ROOT not in sys.path:
+    sys.path.append(APP_ROOT)
+
+from distance import haversine_many
+from grid_planner import Grid, astar
+from mast_store import source_stamp
+
+COST_MAP_PATH = "cost_maps"
+COST_MAP_VERSION = 2  # 2: bilinear elevation from app/line_of_sight
+
+MAST_CLEARANCE = 30  # Distance (meters) to keep from masts
+MAST_PENALTY = 1.0  # Extra cost per meter right outside the clearance, fading out at twice the clearance
+CLIMB_WEIGHT = 3.0  # Cost of a meter of climbing or descending, in meters of flight
+BOX_MARGIN = 0.005  # Margin (degrees) around start and end, when no bounding box is given
+
+
+class CostMap(NamedTuple):
+    """
+    Cost layers on the nodes of a grid.
+
+    cost is the extra cost per meter of flight through a node: 0 for open
+    terrain, inf where the drone may not fly. elevation is the terrain
+    height (meters) at the node, or None without an elevation model.
+    """
+
+    cost: np.ndarray
+    elevation: Optional[np.ndarray]
+
+    def edge_weights(self, grid: Grid, climb_weight: float = CLIMB_WEIGHT) -> np.ndarray:
+        """Weights of the edges of the grid, never less than their length"""
+        sources = np.repeat(np.arange(len(grid)), np.diff(grid.indptr))
+        targets = grid.indices
+        weights = grid.weights * (1 + (self.cost[sources] + self.cost[targets]) / 2)
+        if self.elevation is not None:
+            climb = np.abs(self.elevation[targets] - self.elevation[sources])
+            weights += climb_weight * np.nan_to_num(climb)
+        return weights
+
+
+def sample_elevation(grid: Grid, path: str) -> np.ndarray:
+    """
+    Terrain height at the nodes of a grid, from an elevation model (GeoTIFF in
+    longitude/latitude), see app/line_of_sight.ElevationModel.
+
+    :return: Elevations in meters, nan outside the raster or on nodata pixels
+    """
+    from line_of_sight import ElevationModel
+
+    return ElevationModel(path).sample(grid.points[:, 0], grid.points[:, 1])
+
+
+def read_polygons(path: str) -> List[List[np.ndarray]]:
+    """
+    Read the polygons of a GeoJSON file.
+
+    :return: The rings of each polygon, as (K, 2) arrays of (longitude, latitude)
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if data["type"] == "FeatureCollection":
+        geometries = [feature["geometry"] for feature in data["features"]]
+    elif data["type"] == "Feature":
+        geometries = [data["geometry"]]
+    else:
+        geometries = [data]
+    polygons = []
+    for geometry in geometries:
+        if geometry["type"] == "Polygon":
+            polygons.append(geometry["coordinates"])
+        elif geometry["type"] == "MultiPolygon":
+            polygons.extend(geometry["coordinates"])
+        else:
+            raise ValueError(f"Unsupported geometry type {geometry['type']}")
+    return [
+        [np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon]
+        for polygon in polygons
+    ]
+
+
+def inside_polygon(points: np.ndarray, rings: List[np.ndarray]) -> np.ndarray:
+    """
+    Whether points are inside a polygon (and not in one of its holes), by counting ring crossings.
+
+    :param points: (N, 2) array of gps points (latitude, longitude)
+    :param rings: The rings of the polygon, as (K, 2) arrays of (longitude, latitude)
+    """
+    lat, lon = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        for (ax, ay, bx, by) in zip(x1, y1, x2, y2):
+            if ay == by:
+                continue
+            crosses = (ay > lat) != (by > lat)
+            x = ax + (lat - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (lon < x)
+    return inside
+
+
+def read_masts(path: str) -> np.ndarray:
+    """
+    Read mast positions from a csv file, with mast_lon and mast_lat columns
+    (like a plan written by plan_sites.py) or lon and lat columns.
+
+    :return: (M, 2) array of gps points (latitude, longitude)
+    """
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        lon, lat = ("mast_lon", "mast_lat") if "mast_lon" in reader.fieldnames else ("lon", "lat")
+        masts = {(float(row[lat]), float(row[lon])) for row in reader if row[lat]}
+    return np.asarray(sorted(masts), dtype=np.float64).reshape(-1, 2)
+
+
+def build_cost_map(
+    grid: Grid,
+    dem_path: Optional[str] = None,
+    no_fly_path: Optional[str] = None,
+    masts: Optional[np.ndarray] = None,
+    mast_clearance: float = MAST_CLEARANCE,
+) -> CostMap:
+    """
+    Compute the cost layers on the nodes of a grid.
+
+    :param dem_path: An elevation model (GeoTIFF in longitude/latitude)
+    :param no_fly_path: A GeoJSON file with the polygons the drone may not fly in
+    :param masts: (M, 2) array of mast positions (latitude, longitude) to keep clear of
+    """
+    cost = np.zeros(len(grid))
+    if no_fly_path:
+        for rings in read_polygons(no_fly_path):
+            cost[inside_polygon(grid.positions, rings)] = np.inf
+    if masts is not None:
+        for mast in masts:
+            d = haversine_many((mast[1], mast[0]), grid.points)
+            near = d < 2 * mast_clearance
+            cost[near] += MAST_PENALTY * (2 * mast_clearance - d[near]) / mast_clearance
+            cost[d < mast_clearance] = np.inf
+    elevation = sample_elevation(grid, dem_path) if dem_path else None
+    return CostMap(cost=cost, elevation=elevation)
+
+
+def load_cost_map(
+    grid: Grid,
+    dem_path: Optional[str] = None,
+    no_fly_path: Optional[str] = None,
+    masts: Optional[np.ndarray] = None,
+    mast_clearance: float = MAST_CLEARANCE,
+    cache_path: str = COST_MAP_PATH,
+) -> CostMap:
+    """
+    Load the cost map of a grid from the cache, or build and cache it.
+
+    Cost maps are cached per area, resolution and layers, and built again when
+    one of the layer files changes.
+    """
+    key = {
+        "version": COST_MAP_VERSION,
+        "box": [grid.south, grid.west, grid.north, grid.east],
+        "resolution": grid.resolution,
+        "dem": [dem_path, source_stamp(dem_path)] if dem_path else None,
+        "no_fly": [no_fly_path, source_stamp(no_fly_path)] if no_fly_path else None,
+        "masts": np.asarray(masts).tolist() if masts is not None else None,
+        "mast_clearance": mast_clearance,
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(cache_path, f"{digest}.npz")
+    if os.path.exists(path):
+        with np.load(path) as data:
+            if data["cost"].shape == (len(grid),):
+                elevation = data["elevation"] if "elevation" in data else None
+                return CostMap(cost=data["cost"], elevation=elevation)
+
+    cost_map = build_cost_map(grid, dem_path, no_fly_path, masts, mast_clearance)
+    os.makedirs(cache_path, exist_ok=True)
+    arrays = {"cost": cost_map.cost}
+    if cost_map.elevation is not None:
+        arrays["elevation"] = cost_map.elevation
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return cost_map
+
+
+def simplify(path: Sequence[int], grid: Grid) -> List[int]:
+    """Leave out the nodes where the path goes straight on"""
+    if len(path) <= 2:
+        return list(path)
+    rows, cols = np.divmod(np.asarray(path), grid.cols)
+    steps = np.stack((np.diff(rows), np.diff(cols)), axis=-1)
+    turns = np.any(steps[1:] != steps[:-1], axis=-1)
+    return [path[0]] + [p for p, turn in zip(path[1:-1], turns) if turn] + [path[-1]]
+
+
+def plan_waypoints(
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    resolution: float,
+    box: Optional[Tuple[float, float, float, float]] = None,
+    dem_path: Optional[str] = None,
+    no_fly_path: Optional[str] = None,
+    masts: Optional[np.ndarray] = None,
+    cache_path: str = COST_MAP_PATH,
+) -> List[Tuple[float, float]]:
+    """
+    Cheapest path between two gps points, around no-fly zones and masts and over low terrain.
+
+    :param start: A gps point (latitude, longitude)
+    :param end: A gps point (latitude, longitude)
+    :param resolution: Distance between grid nodes (degrees)
+    :param box: (south, west, north, east) of the area to plan in, by default
+        the box around start and end with a margin of BOX_MARGIN
+
+    :return: The waypoints (latitude, longitude), for Exercises/mavlink.run
+    """
+    if box is None:
+        box = (
+            min(start[0], end[0]) - BOX_MARGIN,
+            min(start[1], end[1]) - BOX_MARGIN,
+            max(start[0], end[0]) + BOX_MARGIN,
+            max(start[1], end[1]) + BOX_MARGIN,
+        )
+    grid = Grid(*box, resolution, diagonal=True)
+    cost_map = load_cost_map(grid, dem_path, no_fly_path, masts, cache_path=cache_path)
+    path = astar(grid, grid.node(start), grid.node(end), cost_map.edge_weights(grid))
+    return [tuple(p) for p in grid.positions[simplify(path, grid)].tolist()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Plan a path around no-fly zones and masts, and over low terrain"
+    )
+    parser.add_argument(
+        "--start", nargs=2, type=float, required=True, metavar=("LAT", "LON")
+    )
+    parser.add_argument("--end", nargs=2, type=float, required=True, metavar=("LAT", "LON"))
+    parser.add_argument(
+        "--box",
+        nargs=4,
+        type=float,
+        default=None,
+        metavar=("SOUTH", "WEST", "NORTH", "EAST"),
+        help="Area to plan in, default=around start and end",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        default=0.0005,
+        help="Distance between grid nodes in degrees, default=0.0005",
+    )
+    parser.add_argument(
+        "--dem", metavar="GEOTIFF", default=None, help="Elevation model, in longitude/latitude"
+    )
+    parser.add_argument(
+        "--no-fly", metavar="GEOJSON", default=None, help="Polygons the drone may not fly in"
+    )
+    parser.add_argument(
+        "--masts",
+        metavar="CSV",
+        default=None,
+        help="Masts to keep clear of: a plan from plan_sites.py, or a csv file with lon and lat columns",
+    )
+    parser.add_argument(
+        "--fly", action="store_true", help="Fly the path, like mavlink.py"
+    )
+    config = parser.parse_args()
+
+    waypoints = plan_waypoints(
+        tuple(config.start),
+        tuple(config.end),
+        config.resolution,
+        tuple(config.box) if config.box else None,
+        config.dem,
+        config.no_fly,
+        read_masts(config.masts) if config.masts else None,
+    )
+    print(waypoints)
+    if config.fly:
+        from mavlink import run
+
+        asyncio.get_event_loop().run_until_complete(run(waypoints))
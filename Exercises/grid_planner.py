@@ -0,0 +1,165 @@
+import heapq
+import math
+import sys
+from os.path import dirname, join, realpath
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+APP_ROOT = join(dirname(realpath(__file__)), "..", "app")
+if APP_ROOT not in sys.path:
+    sys.path.append(APP_ROOT)
+
+from distance import haversine_many, haversine_pairs
+
+# Neighbours of a grid node, as (row, column) offsets. Only one direction of
+# each edge is listed, the other one is added when the edges are built.
+STRAIGHT_OFFSETS = [(0, 1), (1, 0)]
+DIAGONAL_OFFSETS = [(1, 1), (1, -1)]
+
+
+class Grid:
+    """
+    A regular latitude/longitude grid over a bounding box, as a graph.
+
+    Nodes are numbered row by row, from the north-west corner. The last row
+    and column are moved onto the south and east edges of the box, so the
+    whole box is covered. Edges connect neighbouring nodes (and diagonal
+    neighbours, if diagonal is set), weighted by their length in meters, and
+    are stored in CSR arrays: the neighbours of node u are
+    indices[indptr[u]:indptr[u + 1]], at the distances in the same slice of weights.
+
+    :param south: Southern edge of the box (latitude)
+    :param west: Western edge of the box (longitude)
+    :param north: Northern edge of the box (latitude)
+    :param east: Eastern edge of the box (longitude)
+    :param resolution: Distance between neighbouring nodes (degrees)
+    """
+
+    def __init__(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        resolution: float,
+        diagonal: bool = False,
+    ):
+        if north < south or east < west:
+            raise ValueError("The bounding box must have north >= south and east >= west")
+        self.south, self.west, self.north, self.east = south, west, north, east
+        self.resolution = resolution
+        # Rounded, so floating point noise does not add a row or column
+        self.rows = math.ceil(round((north - south) / resolution, 9)) + 1
+        self.cols = math.ceil(round((east - west) / resolution, 9)) + 1
+        self.lats = np.maximum(north - np.arange(self.rows) * resolution, south)
+        self.lons = np.minimum(west + np.arange(self.cols) * resolution, east)
+
+        lat, lon = np.meshgrid(self.lats, self.lons, indexing="ij")
+        # (N, 2) array of node positions (latitude, longitude)
+        self.positions = np.stack((lat.ravel(), lon.ravel()), axis=-1)
+        # The same positions as (longitude, latitude), the order app/distance.py takes
+        self.points = np.ascontiguousarray(self.positions[:, ::-1])
+
+        offsets = STRAIGHT_OFFSETS + (DIAGONAL_OFFSETS if diagonal else [])
+        node = np.arange(self.rows * self.cols).reshape(self.rows, self.cols)
+        sources = []
+        targets = []
+        for (dr, dc) in offsets:
+            # The nodes whose neighbour at this offset is inside the grid
+            rows = slice(0, self.rows - dr)
+            cols = slice(max(0, -dc), self.cols - max(0, dc))
+            u = node[rows, cols].ravel()
+            v = u + dr * self.cols + dc
+            sources += [u, v]
+            targets += [v, u]
+        self._set_edges(np.concatenate(sources), np.concatenate(targets))
+
+    def _set_edges(self, sources: np.ndarray, targets: np.ndarray):
+        order = np.argsort(sources, kind="stable")
+        sources = sources[order]
+        self.indices = targets[order]
+        self.indptr = np.zeros(len(self) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(sources, minlength=len(self)), out=self.indptr[1:])
+        self.weights = haversine_pairs(self.points[sources], self.points[self.indices])
+
+    def __len__(self) -> int:
+        return self.rows * self.cols
+
+    @property
+    def edges(self) -> np.ndarray:
+        """(E, 2) array of the edges (source, target), in both directions"""
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return np.stack((sources, self.indices), axis=-1)
+
+    def node(self, p: Tuple[float, float]) -> int:
+        """The node closest to a gps point (latitude, longitude)"""
+        row = int(np.abs(self.lats - p[0]).argmin())
+        col = int(np.abs(self.lons - p[1]).argmin())
+        return row * self.cols + col
+
+
+def astar(
+    grid: Grid, source: int, target: int, weights: Optional[np.ndarray] = None
+) -> List[int]:
+    """
+    Shortest path between two nodes of a grid, with A*.
+
+    The heuristic is the great circle distance to the target, which never
+    overestimates the remaining distance as long as no edge weighs less than
+    its length.
+
+    :param weights: Weight of each edge, in the order of grid.weights, defaults to the length
+    :return: The nodes on the path, from source to target
+    :raises ValueError: If the target cannot be reached
+    """
+    if weights is None:
+        weights = grid.weights
+    heuristic = haversine_many(grid.points[target], grid.points)
+    cost = np.full(len(grid), np.inf)
+    parent = np.full(len(grid), -1, dtype=np.intp)
+    done = np.zeros(len(grid), dtype=bool)
+    cost[source] = 0
+    queue = [(heuristic[source], source)]
+    while queue:
+        _, u = heapq.heappop(queue)
+        if done[u]:
+            continue
+        if u == target:
+            break
+        done[u] = True
+        start, end = grid.indptr[u], grid.indptr[u + 1]
+        neighbours = grid.indices[start:end]
+        new_cost = cost[u] + weights[start:end]
+        better = new_cost < cost[neighbours]
+        neighbours = neighbours[better]
+        cost[neighbours] = new_cost[better]
+        parent[neighbours] = u
+        for v, f in zip(
+            neighbours.tolist(), (new_cost[better] + heuristic[neighbours]).tolist()
+        ):
+            heapq.heappush(queue, (f, v))
+
+    if not np.isfinite(cost[target]):
+        raise ValueError(f"Node {target} cannot be reached from node {source}")
+    path = [target]
+    while path[-1] != source:
+        path.append(int(parent[path[-1]]))
+    return path[::-1]
+
+
+def plan_path(
+    grid: Grid,
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    weights: Optional[np.ndarray] = None,
+) -> List[Tuple[float, float]]:
+    """
+    Shortest path over a grid between the nodes closest to two gps points.
+
+    :param start: A gps point (latitude, longitude)
+    :param end: A gps point (latitude, longitude)
+    :return: The waypoints (latitude, longitude) of the path
+    """
+    path = astar(grid, grid.node(start), grid.node(end), weights)
+    return [tuple(p) for p in grid.positions[path].tolist()]
@@ -1,8 +1,6 @@
-import networkx as nx
 import plotly.graph_objects as go
-import networkx as nx
-import math
-from distance import haversine
+from typing import List, Tuple
+from grid_planner import Grid, astar
 
 TOPLEFT = (55.3714, 10.424)
 TOPRIGHT = (55.3714, 10.4328)
@@ -12,85 +10,51 @@ BOTRIGHT = (55.3659, 10.4328)
 RESOLUTION = 0.001
 
 
-def render(graph: nx.Graph, edge_pairs: list):
-    # for node, coords in nx.get_node_attributes(graph, 'pos').items():
-    #     print(node, coords)
+def render(grid: Grid, path: List[int]):
     fig = go.Figure(
         go.Scattermapbox(
             mode="markers",
-            lat=[c[0] for c in nx.get_node_attributes(graph, "pos").values()],
-            lon=[c[1] for c in nx.get_node_attributes(graph, "pos").values()],
+            lat=grid.positions[:, 0],
+            lon=grid.positions[:, 1],
             hoverinfo="text",
-            text=[f"Node index: {n}" for n in graph.nodes],
+            text=[f"Node index: {n}" for n in range(len(grid))],
             marker={"size": 10},
         )
     )
     fig.update_layout(
         margin={"l": 0, "t": 0, "b": 0, "r": 0},
         mapbox={
-            "center": {"lon": 10.4284, "lat": 55.36865},
+            "center": {
+                "lon": (grid.west + grid.east) / 2,
+                "lat": (grid.south + grid.north) / 2,
+            },
             "style": "stamen-terrain",
             "zoom": 15,
         },
     )
-    for u, v in graph.edges:
-        fig.add_trace(
-            go.Scattermapbox(
-                mode="lines",
-                lon=[graph.nodes[u]["pos"][1], graph.nodes[v]["pos"][1]],
-                lat=[graph.nodes[u]["pos"][0], graph.nodes[v]["pos"][0]],
-                line={"color": "green" if (u, v) in edge_pairs else "red"},
-                hovertext=f"{graph.edges[u, v]['dist']}",
-            )
-        )
-    fig.show()
-
-
-def drawGraph():
-    graph = nx.Graph()
-    # # graph.add_node(1000, pos=TOPRIGHT)
-    # graph.add_node(1001, pos=TOPLEFT)
-    # # graph.add_node(1002, pos=BOTRIGHT)
-    # graph.add_node(1003, pos=BOTLEFT)
 
-    lat = TOPRIGHT[0]
-
-    node_index = 1
-
-    first_run = True
-    nodes_in_row = math.ceil((TOPRIGHT[1] - TOPLEFT[1]) / RESOLUTION) + 1
-
-    while lat + RESOLUTION >= BOTRIGHT[0]:
-        prev = None
-        long = TOPRIGHT[1]
-        while long + RESOLUTION >= TOPLEFT[1]:
-            graph.add_node(node_index)
-            graph.nodes[node_index]["pos"] = (
-                max(lat, BOTRIGHT[0]),
-                max(long, TOPLEFT[1]),
-            )
-            if prev:
-                d = haversine(graph.nodes[prev]["pos"], graph.nodes[node_index]["pos"])
-                graph.add_edge(prev, node_index, dist=d)
-            if not first_run:
-                d = haversine(
-                    graph.nodes[node_index]["pos"],
-                    graph.nodes[node_index - nodes_in_row]["pos"],
-                )
-                graph.add_edge(node_index, node_index - nodes_in_row, dist=d)
-            prev = node_index
-            long -= RESOLUTION
-            node_index += 1
-        lat -= RESOLUTION
-        first_run = False
-    # print(graph.nodes)
-    shortestPath = nx.shortest_path(graph, source=1, target=70, weight="dist")
-    edge_pairs = list(zip(shortestPath[:-1], shortestPath[1:]))
+    def lines(edges, color):
+        # All edges in one trace, separated by None
+        lat = [None] * (3 * len(edges))
+        lon = [None] * (3 * len(edges))
+        for k, (u, v) in enumerate(edges):
+            lat[3 * k], lat[3 * k + 1] = grid.positions[u, 0], grid.positions[v, 0]
+            lon[3 * k], lon[3 * k + 1] = grid.positions[u, 1], grid.positions[v, 1]
+        fig.add_trace(go.Scattermapbox(mode="lines", lat=lat, lon=lon, line={"color": color}))
+
+    edges = [(u, v) for (u, v) in grid.edges.tolist() if u < v]
+    lines(edges, "red")
+    lines(list(zip(path[:-1], path[1:])), "green")
+    fig.show()
 
-    edge_pairs = list(zip(shortestPath[:-1], shortestPath[1:]))
 
-    render(graph, edge_pairs)
-    return list(map(lambda p: graph.nodes[p]["pos"], shortestPath))
+def drawGraph(show: bool = True) -> List[Tuple[float, float]]:
+    grid = Grid(BOTLEFT[0], BOTLEFT[1], TOPRIGHT[0], TOPRIGHT[1], RESOLUTION)
+    # From the north-east to the south-west corner
+    path = astar(grid, grid.node(TOPRIGHT), grid.node(BOTLEFT))
+    if show:
+        render(grid, path)
+    return [tuple(p) for p in grid.positions[path].tolist()]
 
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import asyncio
+import threading
+
 import cv2
 import gi
 import numpy as np
@@ -18,18 +21,29 @@ class Video:
         video_sink (object): Gstreamer sink element
         video_sink_conf (string): Sink configuration
         video_source (string): Udp source ip and port
+        size (tuple): (width, height) frames are scaled to, or None for the stream resolution
+
+    Every frame is copied once, from the mapped GStreamer buffer into an array
+    of its own that is never written to again. Callers all share that array,
+    read-only, and may keep it as long as they like.
     """
 
-    def __init__(self, port=5600):
+    def __init__(self, port=5600, size=None):
         """Summary
         Args:
             port (int, optional): UDP port
+            size (tuple, optional): (width, height) to scale frames to in the pipeline
         """
 
         Gst.init(None)
 
         self.port = port
+        self.size = size
         self._frame = None
+        self._frame_seq = 0
+        # Futures of coroutines waiting in next_frame, with the event loop they belong to
+        self._waiters = []
+        self._lock = threading.Lock()
 
         # [Software component diagram](https://www.ardusub.com/software/components.html)
         # UDP video stream (:5600)
@@ -40,9 +54,16 @@ class Video:
             "! application/x-rtp, payload=96 ! rtph264depay ! h264parse ! avdec_h264"
         )
         # Python don't have nibble, convert YUV nibbles (4-4-4) to OpenCV standard BGR bytes (8-8-8)
-        self.video_decode = (
-            "! decodebin ! videoconvert ! video/x-raw,format=(string)BGR ! videoconvert"
-        )
+        # Converting and scaling in a single step, straight to the size the consumer needs
+        if size:
+            self.video_decode = (
+                "! decodebin ! videoconvert ! videoscale"
+                " ! video/x-raw,format=(string)BGR,width={},height={}".format(*size)
+            )
+        else:
+            self.video_decode = (
+                "! decodebin ! videoconvert ! video/x-raw,format=(string)BGR"
+            )
         # Create a sink to get data
         self.video_sink_conf = (
             "! appsink emit-signals=true sync=false max-buffers=2 drop=true"
@@ -85,23 +106,49 @@ class Video:
         Returns:
             TYPE: Description
         """
-        buf = sample.get_buffer()
-        caps = sample.get_caps()
-        array = np.ndarray(
-            (
-                caps.get_structure(0).get_value("height"),
-                caps.get_structure(0).get_value("width"),
-                3,
-            ),
-            buffer=buf.extract_dup(0, buf.get_size()),
-            dtype=np.uint8,
-        )
+        height, width = Video.sample_shape(sample)
+        array = np.empty((height, width, 3), dtype=np.uint8)
+        Video.copy_sample(sample, array)
         return array
 
+    @staticmethod
+    def sample_shape(sample):
+        """Get the frame size of a sample
+        Args:
+            sample (TYPE): Description
+        Returns:
+            tuple: (height, width)
+        """
+        structure = sample.get_caps().get_structure(0)
+        return (structure.get_value("height"), structure.get_value("width"))
+
+    @staticmethod
+    def copy_sample(sample, out):
+        """Copy the BGR frame of a sample into an existing np array,
+        reading the buffer in place instead of duplicating it first
+        Args:
+            sample (TYPE): Description
+            out (np.ndarray): (height, width, 3) uint8 array to copy the frame into
+        """
+        buf = sample.get_buffer()
+        height, width = out.shape[:2]
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            raise RuntimeError("Could not map video buffer")
+        try:
+            # Rows may be padded, so view the buffer row by row before dropping the padding
+            stride = map_info.size // height
+            rows = np.frombuffer(map_info.data, dtype=np.uint8, count=height * stride)
+            np.copyto(
+                out, rows.reshape(height, stride)[:, : width * 3].reshape(out.shape)
+            )
+        finally:
+            buf.unmap(map_info)
+
     def frame(self):
         """Get Frame
         Returns:
-            iterable: bool and image frame, cap.read() output
+            np.ndarray: The latest frame (read-only), or None before the first frame
         """
         return self._frame
 
@@ -112,6 +159,33 @@ class Video:
         """
         return type(self._frame) != type(None)
 
+    @property
+    def frame_seq(self):
+        """Sequence number of the latest frame, 0 until the first frame arrives"""
+        return self._frame_seq
+
+    async def next_frame(self, after=None):
+        """Wait for a new frame, without blocking the event loop
+        Args:
+            after (int, optional): Sequence number of the last frame the caller used.
+                If a newer frame already arrived it is returned right away,
+                otherwise (and by default) the next frame is waited for.
+        Returns:
+            tuple: (sequence number, frame), the frame is read-only
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if after is not None and self._frame_seq > after:
+                return self._frame_seq, self._frame
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        return await future
+
+    @staticmethod
+    def _resolve(future, result):
+        if not future.done():
+            future.set_result(result)
+
     def run(self):
         """Get frame to update _frame"""
 
@@ -129,7 +203,15 @@ class Video:
     def callback(self, sink):
         sample = sink.emit("pull-sample")
         new_frame = self.gst_to_opencv(sample)
-        self._frame = new_frame
+        new_frame.flags.writeable = False  # Shared by all callers
+        with self._lock:
+            self._frame = new_frame
+            self._frame_seq += 1
+            seq = self._frame_seq
+            waiters, self._waiters = self._waiters, []
+        # This runs on a GStreamer thread, so hand the frame to each event loop
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._resolve, future, (seq, new_frame))
 
         return Gst.FlowReturn.OK
 
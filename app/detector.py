@@ -0,0 +1,86 @@
+import pathlib
+import sys
+from os.path import dirname, join, realpath
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import torch
+
+YOLO_ROOT = join(dirname(realpath(__file__)), "..", "yolov5-master")
+if YOLO_ROOT not in sys.path:
+    sys.path.append(YOLO_ROOT)
+
+from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
+from utils.general import check_img_size, non_max_suppression, scale_boxes
+from utils.torch_utils import select_device
+
+# The single-class hotair-baloon model trained on data/HotAir.yaml
+DEFAULT_WEIGHTS = join(
+    YOLO_ROOT, "runs", "train", "yolov5s_results2", "weights", "best.pt"
+)
+DEFAULT_IMAGE_SIZE = 640
+
+# The weights were trained on Windows, and pickled with WindowsPath objects
+if sys.platform != "win32":
+    pathlib.WindowsPath = pathlib.PosixPath
+
+
+class Detection(NamedTuple):
+    box: Tuple[float, float, float, float]  # x1, y1, x2, y2 in pixels of the frame
+    confidence: float
+
+
+class MastDetector:
+    """
+    YOLOv5 detector for masts (hot air balloons in the simulation).
+
+    The model is loaded and warmed up once, so later calls to detect only pay
+    for the inference itself.
+    """
+
+    def __init__(
+        self,
+        weights: str = DEFAULT_WEIGHTS,
+        image_size: int = DEFAULT_IMAGE_SIZE,
+        device: str = "cpu",
+        conf_thres: float = 0.25,
+        iou_thres: float = 0.45,
+    ):
+        self.device = select_device(device)
+        self.model = DetectMultiBackend(weights, device=self.device, fuse=True)
+        self.model.eval()
+        self.image_size = check_img_size(image_size, s=self.model.stride)
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.warmup()
+
+    def warmup(self):
+        """Run one inference, so the first frame is not slowed down by lazy initialization"""
+        self.detect(np.zeros((self.image_size, self.image_size, 3), dtype=np.uint8))
+
+    @torch.no_grad()
+    def detect(self, frame: np.ndarray) -> Optional[Detection]:
+        """
+        Find the most confident mast in a frame.
+
+        :param frame: (height, width, 3) BGR image, as delivered by Video
+        :return: The detection, or None if there is no mast in the frame
+        """
+        im = letterbox(
+            frame, self.image_size, stride=self.model.stride, auto=self.model.pt
+        )[0]
+        im = np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])  # HWC to CHW, BGR to RGB
+        im = torch.from_numpy(im).to(self.device)
+        im = im.half() if self.model.fp16 else im.float()
+        im = im[None] / 255
+
+        pred = self.model(im)
+        det = non_max_suppression(pred, self.conf_thres, self.iou_thres, max_det=10)[0]
+        if not len(det):
+            return None
+        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], frame.shape).round()
+        best = det[det[:, 4].argmax()]
+        return Detection(
+            box=tuple(float(v) for v in best[:4]), confidence=float(best[4])
+        )
@@ -1,5 +1,14 @@
 from math import sin, sqrt, asin, cos, radians
-from typing import Tuple
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# Mean radius of earth in meters. Use 3956 * 1609.344 for miles.
+# Shared by every distance function, so results agree.
+EARTH_RADIUS_M = 6371 * 1000
+
+# Default memory budget for a single block of a pairwise distance matrix
+DEFAULT_MATRIX_BUDGET_BYTES = 64 * 1024 * 1024
 
 
 def distance(a, b):
@@ -32,7 +41,87 @@ def haversine(p1: Tuple[float, float], p2: Tuple[float, float]):
     dlat = lat2 - lat1
     a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
     c = 2 * asin(sqrt(a))
-    r = (
-        6372.8 * 1000
-    )  # Radius of earth in meters. Use 3956 for miles. Determines return value units.
-    return c * r
+    return c * EARTH_RADIUS_M
+
+
+def _as_points(points) -> np.ndarray:
+    points = np.asarray(points, dtype=np.float64)
+    if points.shape[-1] != 2:
+        raise ValueError(
+            f"Expected (longitude, latitude) pairs, got an array of shape {points.shape}"
+        )
+    return points
+
+
+def _haversine_broadcast(p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
+    lon1, lat1 = np.radians(p1[..., 0]), np.radians(p1[..., 1])
+    lon2, lat2 = np.radians(p2[..., 0]), np.radians(p2[..., 1])
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def haversine_pairs(p1, p2) -> np.ndarray:
+    """
+    Element-wise great circle distance in meters between two sets of points.
+
+    :param p1: An (N, 2) array of gps points (longitude, latitude)
+    :param p2: An (N, 2) array of gps points (longitude, latitude)
+
+    :return: An (N,) array of distances in meters
+    """
+    return _haversine_broadcast(_as_points(p1), _as_points(p2))
+
+
+def haversine_many(p: Tuple[float, float], points) -> np.ndarray:
+    """
+    Great circle distance in meters from one point to each of N points.
+
+    :param p: A gps point (longitude, latitude)
+    :param points: An (N, 2) array of gps points (longitude, latitude)
+
+    :return: An (N,) array of distances in meters
+    """
+    return _haversine_broadcast(_as_points(p), _as_points(points))
+
+
+def haversine_matrix(a, b) -> np.ndarray:
+    """
+    Pairwise great circle distances in meters.
+
+    :param a: An (N, 2) array of gps points (longitude, latitude)
+    :param b: An (M, 2) array of gps points (longitude, latitude)
+
+    :return: An (N, M) array, where [i, j] is the distance from a[i] to b[j]
+    """
+    a = _as_points(a).reshape(-1, 2)
+    b = _as_points(b).reshape(-1, 2)
+    return _haversine_broadcast(a[:, None, :], b[None, :, :])
+
+
+def haversine_matrix_chunked(
+    a, b, max_bytes: int = DEFAULT_MATRIX_BUDGET_BYTES
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Pairwise great circle distances in meters, computed in blocks of rows.
+
+    Each block (and the temporaries used to compute it) stays within max_bytes,
+    so distances between large point sets can be reduced without holding the
+    full (N, M) matrix in memory.
+
+    :param a: An (N, 2) array of gps points (longitude, latitude)
+    :param b: An (M, 2) array of gps points (longitude, latitude)
+    :param max_bytes: Memory budget for a single block
+
+    :return: Iterator of (first row, block) where block is the distance matrix
+        for a[first row : first row + len(block)] against all of b
+    """
+    a = _as_points(a).reshape(-1, 2)
+    b = _as_points(b).reshape(-1, 2)
+    # The haversine formula holds a handful of float64 temporaries per element
+    bytes_per_row = max(1, len(b)) * np.dtype(np.float64).itemsize * 4
+    rows = max(1, int(max_bytes // bytes_per_row))
+    for start in range(0, len(a), rows):
+        yield start, haversine_matrix(a[start : start + rows], b)
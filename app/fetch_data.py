@@ -1,15 +1,203 @@
 import requests
 import json
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from mast_store import (
+    MAST_DATA_PATH,
+    MAST_STORE_PATH,
+    build_store,
+    encode_record,
+    open_store,
+    update_store,
+    write_store,
+)
+from mastT import Mast
 
 TECH_TYPES = {"UMTS": 7, "LTE": 29, "GSM": 39, "TK": 41, "5G-NR": 42}
 
 BASE_URL = "https://mastedatabasen.dk/Master/antenner.json?tjeneste=2&maxantal=9999999"
 
+CHANGELOG_PATH = "mast_changelog.jsonl"
+
+# Masts are compared between snapshots by these fields
+MastKey = Tuple[str, str]
+
+
+def mast_key(mast: Mast) -> MastKey:
+    return (mast["unik_station_navn"], mast["frekvensbaand"])
+
+
+def fetch_technology(
+    session: requests.Session,
+    technology: int,
+    validators: Optional[dict] = None,
+    base_url: str = BASE_URL,
+) -> Tuple[Optional[List[Mast]], dict]:
+    """
+    Download the masts of a single technology.
+
+    :param session: The session to download with
+    :param technology: Technology id, one of the values of TECH_TYPES
+    :param validators: ETag/Last-Modified returned by the previous download of this technology
+    :param base_url: The mastedatabasen.dk query to add the technology to
+
+    :return: The masts, or None if they have not changed since the previous
+        download, and the validators to send with the next download
+    """
+    headers = {}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    r = session.get(f"{base_url}&teknologier={technology}", headers=headers)
+    if r.status_code == 304:
+        return None, validators
+    r.raise_for_status()
+    return r.json(), {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+    }
+
+
+def fetch_all(
+    technologies: List[int], sync_state: Dict[str, dict], base_url: str = BASE_URL
+) -> Dict[int, Tuple[Optional[List[Mast]], dict]]:
+    """Download every technology concurrently, over one pooled session"""
+    if not technologies:
+        return {}  # A pool of 0 connections or workers is an error
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=len(technologies))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=len(technologies)) as pool:
+            results = pool.map(
+                lambda t: fetch_technology(
+                    session, t, sync_state.get(str(t)), base_url
+                ),
+                technologies,
+            )
+            return dict(zip(technologies, results))
+
+
+def sync(
+    store_path: str = MAST_STORE_PATH,
+    changelog_path: Optional[str] = CHANGELOG_PATH,
+    base_url: str = BASE_URL,
+    technologies: Optional[List[int]] = None,
+) -> dict:
+    """
+    Bring the mast store up to date with mastedatabasen.dk.
+
+    Technologies that have not changed since the last sync (according to the
+    server) are not downloaded again. The downloaded masts are compared with
+    the store by unik_station_navn and frekvensbaand, and the store is only
+    rewritten if something was added, removed or changed. Unchanged masts are
+    copied over as stored, without being decoded.
+
+    :param store_path: The mast store to update, created if it does not exist
+    :param changelog_path: File to append the changes to, one json object per sync
+    :param base_url: The mastedatabasen.dk query to add each technology to
+    :param technologies: Technology ids to download, defaults to all of TECH_TYPES
+
+    :return: The changes, as appended to the changelog
+    """
+    if technologies is None:
+        technologies = list(TECH_TYPES.values())
+    try:
+        store = open_store(store_path)
+    except (OSError, ValueError, KeyError):
+        store = None
+    source = dict(store.source) if store is not None else {}
+    sync_state = dict(source.get("sync", {}))
+
+    pages = fetch_all(technologies, sync_state, base_url)
+
+    new_groups: Dict[MastKey, List[Mast]] = defaultdict(list)
+    refreshed = set()
+    for technology, (masts, validators) in pages.items():
+        sync_state[str(technology)] = validators
+        if masts is None:
+            continue
+        refreshed.add(str(technology))
+        for mast in masts:
+            new_groups[mast_key(mast)].append(mast)
+
+    # Group the stored rows of every re-downloaded technology the same way
+    old_groups: Dict[MastKey, List[int]] = defaultdict(list)
+    if store is not None:
+        codes = [c for c, id in enumerate(store.technology_ids) if id in refreshed]
+        for i in np.flatnonzero(np.isin(store.technology, codes)):
+            old_groups[(store.name(i), store.bands[store.band[i]])].append(int(i))
+
+    added = [key for key in new_groups if key not in old_groups]
+    removed = [key for key in old_groups if key not in new_groups]
+    changed = [
+        key
+        for key in new_groups
+        if key in old_groups
+        and sorted(store.raw_record(i) for i in old_groups[key])
+        != sorted(encode_record(mast) for mast in new_groups[key])
+    ]
+
+    source["sync"] = sync_state
+    if store is None:
+        write_store(
+            [mast for masts in new_groups.values() for mast in masts],
+            store_path,
+            source,
+        )
+    elif added or removed or changed:
+        dropped = {i for key in removed + changed for i in old_groups[key]}
+        update_store(
+            store,
+            keep=[i for i in range(len(store)) if i not in dropped],
+            added=[mast for key in added + changed for mast in new_groups[key]],
+            source=source,
+        )
+    else:
+        store.set_source(source)
+
+    changes = {
+        "time": datetime.now().isoformat(),
+        "added": [list(key) for key in added],
+        "removed": [list(key) for key in removed],
+        "changed": [list(key) for key in changed],
+    }
+    if changelog_path:
+        with open(changelog_path, "a") as f:
+            f.write(json.dumps(changes, ensure_ascii=False) + "\n")
+    return changes
+
 
 if __name__ == "__main__":
-    r = requests.get(
-        f"{BASE_URL}&teknologier={','.join(map(str, TECH_TYPES.values()))}"
+    parser = argparse.ArgumentParser(
+        description="Download the mast database from mastedatabasen.dk"
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only download changed technologies, and only write changed masts to the mast store",
     )
-    data = r.json()
-    with open("mast_data.json", "w") as f:
-        f.write(json.dumps(data, indent=2))
+    config = parser.parse_args()
+
+    if config.sync:
+        changes = sync()
+        print(
+            f"Added {len(changes['added'])}, removed {len(changes['removed'])}, "
+            f"changed {len(changes['changed'])} masts"
+        )
+    else:
+        r = requests.get(
+            f"{BASE_URL}&teknologier={','.join(map(str, TECH_TYPES.values()))}"
+        )
+        data = r.json()
+        with open(MAST_DATA_PATH, "w") as f:
+            f.write(json.dumps(data, indent=2))
+        # Convert to the binary store, so the mission never has to parse the json
+        build_store(MAST_DATA_PATH)
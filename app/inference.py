@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from loguru import logger
+
+# An input, with the context, event loop and future of the caller waiting for its prediction
+Request = Tuple[Any, contextvars.Context, asyncio.AbstractEventLoop, asyncio.Future]
+
+
+class InferenceWorker:
+    """
+    Runs a (slow, blocking) prediction function on dedicated threads.
+
+    Callers on an event loop submit inputs and await the returned futures, so the
+    loop keeps running during predictions. Inputs are submitted per stream (a
+    camera). At most one input of each stream waits while others are being
+    predicted: submitting a new input drops the waiting one of the same stream
+    (latest frame wins), and the future of a dropped input resolves to None. A
+    backlog of stale frames can therefore never build up. The threads take the
+    waiting inputs of the streams in turn, oldest first. Predictions run in the
+    context of the submitting caller, so their log lines keep its drone name.
+    """
+
+    def __init__(
+        self, predict: Callable[[Any], Any], name: str = "inference", workers: int = 1
+    ):
+        self._predict = predict
+        self._pending: Dict[Hashable, Request] = {}  # In the order the inputs arrived
+        self._closed = False
+        self._condition = threading.Condition()
+        self.dropped = 0
+        self._threads = [
+            threading.Thread(
+                target=self._run,
+                name=name if workers == 1 else f"{name}-{i}",
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item, stream: Hashable = None) -> asyncio.Future:
+        """
+        Queue an input for prediction.
+
+        :param stream: The stream the input belongs to
+        :return: A future with the prediction, or None if a newer input replaced this one
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Inference worker is closed")
+            old = self._pending.pop(stream, None)
+            if old is not None:
+                _, _, old_loop, old_future = old
+                old_loop.call_soon_threadsafe(self._resolve, old_future, None)
+                self.dropped += 1
+            self._pending[stream] = (item, contextvars.copy_context(), loop, future)
+            self._condition.notify()
+        return future
+
+    def close(self):
+        """Stop the workers after the current predictions. Waiting inputs resolve to None."""
+        with self._condition:
+            self._closed = True
+            for (_, _, loop, future) in self._pending.values():
+                loop.call_soon_threadsafe(self._resolve, future, None)
+            self._pending.clear()
+            self._condition.notify_all()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, exception: BaseException):
+        if not future.done():
+            future.set_exception(exception)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                item, context, loop, future = self._pending.pop(next(iter(self._pending)))
+
+            try:
+                result = context.run(self._predict, item)
+            except Exception as e:
+                context.run(logger.exception, "Prediction failed")
+                loop.call_soon_threadsafe(self._fail, future, e)
+            else:
+                loop.call_soon_threadsafe(self._resolve, future, result)
@@ -0,0 +1,220 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+import tifffile
+
+from distance import EARTH_RADIUS_M, haversine_pairs
+from mast_index import to_unit_sphere
+from mastT import Mast
+
+# Standard atmospheric refraction bends the line of sight along the earth,
+# equivalent to a straight line over an earth with 4/3 of its real radius.
+REFRACTION_FACTOR = 4 / 3
+
+# Masts are only skipped if the terrain rises at least this much above the line of sight (meters)
+BLOCKED_MARGIN = 2
+
+# Upper bound on the number of elevation samples in memory at once
+MAX_SAMPLES_IN_MEMORY = 4_000_000
+
+GEOGRAPHIC_MODEL = 2  # GTModelTypeGeoKey of rasters in latitude/longitude
+
+
+class ElevationModel:
+    """
+    Elevation raster (DEM/DSM) read from a GeoTIFF in geographic (longitude, latitude) coordinates.
+
+    Uncompressed rasters are memory-mapped, so only the pixels along the
+    sampled paths are read from disk. Compressed rasters are read into memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            geokeys = tif.geotiff_metadata or {}
+            if int(geokeys.get("GTModelTypeGeoKey", GEOGRAPHIC_MODEL)) != (
+                GEOGRAPHIC_MODEL
+            ):
+                raise ValueError(
+                    f"{path} is not in geographic coordinates, reproject it to EPSG:4326 first"
+                )
+            scale = page.tags["ModelPixelScaleTag"].value
+            tiepoint = page.tags["ModelTiepointTag"].value
+            nodata = page.tags.get("GDAL_NODATA")
+            self.nodata = float(nodata.value) if nodata is not None else None
+
+        # Longitude/latitude of the corner of pixel (0, 0) and the size of a pixel
+        self.lon0 = tiepoint[3] - tiepoint[0] * scale[0]
+        self.lat0 = tiepoint[4] + tiepoint[1] * scale[1]
+        self.dlon = scale[0]
+        self.dlat = scale[1]
+
+        try:
+            self.data = tifffile.memmap(path, mode="r")
+        except ValueError:
+            self.data = tifffile.imread(path)
+        if self.data.ndim == 3:
+            self.data = self.data[..., 0]
+        self.height, self.width = self.data.shape
+
+    @property
+    def resolution_m(self) -> float:
+        """Approximate size of a pixel in meters"""
+        return float(np.radians(min(self.dlon, self.dlat)) * EARTH_RADIUS_M)
+
+    def sample(self, lon, lat) -> np.ndarray:
+        """
+        Bilinearly interpolated elevation at the given coordinates.
+
+        :return: Elevations in meters, nan outside the raster or on nodata pixels
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        # Pixel coordinates, relative to the centers of the pixels
+        x = (lon - self.lon0) / self.dlon - 0.5
+        y = (self.lat0 - lat) / self.dlat - 0.5
+        inside = (
+            (x >= -0.5)
+            & (y >= -0.5)
+            & (x <= self.width - 0.5)
+            & (y <= self.height - 0.5)
+        )
+        # The outer half of the border pixels has no neighbour to interpolate with
+        x = np.where(inside, x, 0).clip(0, self.width - 1)
+        y = np.where(inside, y, 0).clip(0, self.height - 1)
+        x0 = np.minimum(np.floor(x).astype(np.intp), self.width - 2).clip(0)
+        y0 = np.minimum(np.floor(y).astype(np.intp), self.height - 2).clip(0)
+        fx = x - x0
+        fy = y - y0
+        x1 = np.minimum(x0 + 1, self.width - 1)
+        y1 = np.minimum(y0 + 1, self.height - 1)
+
+        corners = [
+            self.data[y0, x0].astype(np.float64),
+            self.data[y0, x1].astype(np.float64),
+            self.data[y1, x0].astype(np.float64),
+            self.data[y1, x1].astype(np.float64),
+        ]
+        if self.nodata is not None:
+            for corner in corners:
+                corner[corner == self.nodata] = np.nan
+        elevation = (
+            corners[0] * (1 - fx) * (1 - fy)
+            + corners[1] * fx * (1 - fy)
+            + corners[2] * (1 - fx) * fy
+            + corners[3] * fx * fy
+        )
+        return np.where(inside, elevation, np.nan)
+
+
+def great_circle_points(p1: np.ndarray, p2: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    Points along the great circles between pairs of gps points.
+
+    :param p1: A (P, 2) array of gps points (longitude, latitude)
+    :param p2: A (P, 2) array of gps points (longitude, latitude)
+    :param t: An (S,) array of fractions of the way from p1 to p2
+
+    :return: A (P, S, 2) array of gps points (longitude, latitude)
+    """
+    a = to_unit_sphere(p1[:, 0], p1[:, 1])
+    b = to_unit_sphere(p2[:, 0], p2[:, 1])
+    omega = np.arccos(np.clip(np.sum(a * b, axis=-1), -1, 1))[:, None, None]
+    sin_omega = np.sin(omega)
+    t = t[None, :, None]
+    # Spherical interpolation, falling back to linear for (almost) identical points
+    with np.errstate(invalid="ignore", divide="ignore"):
+        wa = np.where(sin_omega > 1e-12, np.sin((1 - t) * omega) / sin_omega, 1 - t)
+        wb = np.where(sin_omega > 1e-12, np.sin(t * omega) / sin_omega, t)
+    xyz = wa * a[:, None, :] + wb * b[:, None, :]
+    lon = np.degrees(np.arctan2(xyz[..., 1], xyz[..., 0]))
+    lat = np.degrees(np.arctan2(xyz[..., 2], np.hypot(xyz[..., 0], xyz[..., 1])))
+    return np.stack((lon, lat), axis=-1)
+
+
+def line_of_sight_margin(
+    dem: ElevationModel,
+    points,
+    targets,
+    observer_height: float,
+    target_height: float,
+    step_m: Optional[float] = None,
+) -> np.ndarray:
+    """
+    How far the terrain stays below the line of sight between pairs of points.
+
+    The line of sight goes from observer_height above the terrain at each point
+    to target_height above the terrain at the same point, over the target (both
+    heights are relative to the starting position of the drone, like
+    MAST_HEIGHT). The terrain is raised by the curvature of the earth
+    (with standard refraction) before it is compared to the line.
+
+    :param dem: The elevation model to sample
+    :param points: A (P, 2) array of gps points (longitude, latitude) the drone checks from
+    :param targets: A (P, 2) array of gps points (longitude, latitude) of the masts
+    :param observer_height: Height of the drone above the terrain at the point (meters)
+    :param target_height: Height of the mast relative to the terrain at the point (meters)
+    :param step_m: Distance between elevation samples, defaults to the raster resolution
+
+    :return: A (P,) array with the smallest distance between the line of sight and
+        the terrain in meters. Negative if the terrain blocks the line of sight,
+        nan if the path leaves the raster.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+    if step_m is None:
+        step_m = max(dem.resolution_m, 1.0)
+
+    lengths = haversine_pairs(points, targets)
+    samples = max(int(np.ceil(lengths.max(initial=0) / step_m)), 1) + 1
+    # Leave out both ends, where the drone and the mast themselves are
+    t = np.linspace(0, 1, samples + 2)[1:-1]
+    chunk = max(1, MAX_SAMPLES_IN_MEMORY // len(t))
+
+    margins = np.empty(len(points))
+    r_eff = EARTH_RADIUS_M * REFRACTION_FACTOR
+    for start in range(0, len(points), chunk):
+        p = points[start : start + chunk]
+        q = targets[start : start + chunk]
+        d = lengths[start : start + chunk, None]
+        z0 = dem.sample(p[:, 0], p[:, 1])[:, None]
+        path = great_circle_points(p, q, t)
+        terrain = dem.sample(path[..., 0], path[..., 1])
+        bulge = t * (1 - t) * d**2 / (2 * r_eff)
+        sight = z0 + observer_height + (target_height - observer_height) * t
+        margins[start : start + chunk] = np.min(sight - (terrain + bulge), axis=1)
+    return margins
+
+
+def screen_masts(
+    dem: ElevationModel,
+    p: Tuple[float, float],
+    masts: List[Tuple[Mast, float]],
+    observer_height: float,
+    target_height: float,
+) -> Tuple[List[Tuple[Mast, float]], List[Tuple[Mast, float]]]:
+    """
+    Split masts into those that may be visible from a point, and those that are clearly blocked.
+
+    Masts whose path leaves the elevation model are kept, as they cannot be ruled out.
+
+    :return: (possibly visible masts, blocked masts), in the order they were given
+    """
+    if not masts:
+        return [], []
+    targets = [
+        (
+            float(mast["wgs84koordinat"]["laengde"]),
+            float(mast["wgs84koordinat"]["bredde"]),
+        )
+        for (mast, _) in masts
+    ]
+    margins = line_of_sight_margin(
+        dem, [p] * len(masts), targets, observer_height, target_height
+    )
+    blocked = margins < -BLOCKED_MARGIN
+    return (
+        [m for m, b in zip(masts, blocked) if not b],
+        [m for m, b in zip(masts, blocked) if b],
+    )
@@ -0,0 +1,275 @@
+import argparse
+import csv
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from os.path import dirname, realpath
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from loguru import logger
+
+from mast_store import source_stamp
+from replay import iter_log
+
+LOGS_PATH = os.path.join(dirname(realpath(__file__)), "..", "logs")
+CACHE_NAME = ".analytics_cache.json"
+CACHE_VERSION = 1
+
+# The timeline columns that are times (seconds since the start of the log)
+TIMES = [
+    "connect",
+    "global_position",
+    "altitude",
+    "first_image",
+    "first_detection",
+    "decision_time",
+]
+
+
+class Timeline(NamedTuple):
+    """
+    What happened when during a run of run_mission.
+
+    Times are in seconds since the first record of the log, and None if the
+    run never got that far.
+    """
+
+    log: str
+    start: float  # Time of the first record, in seconds since the epoch
+    duration: float
+    connect: Optional[float]
+    global_position: Optional[float]
+    altitude: Optional[float]  # The mission altitude was reached
+    first_image: Optional[float]
+    first_detection: Optional[float]  # The detector first found something in an image
+    decision: Optional[str]  # "mast", "obstacle", or None if the run did not decide
+    decision_time: Optional[float]
+    images: int
+    inference_latency: Optional[float]  # Mean time from an image to its prediction
+
+
+def analyze_log(path: str) -> Optional[Timeline]:
+    """
+    Extract the timeline of a run from its log.
+
+    :return: The timeline, or None if the log is empty
+    """
+    start = None
+    t = 0.0
+    times: Dict[str, float] = {}
+    decision = None
+    images = 0
+    latencies = []
+    called = None
+    for record in iter_log(path):
+        if start is None:
+            start = record.time
+        t = record.time - start
+        message = record.message
+        if record.function in ("detect_mast", "image_contains_mast"):
+            if message.endswith(" called"):
+                called = t
+            elif " returned " in message:
+                images += 1
+                if called is not None:
+                    latencies.append(t - called)
+                    called = None
+                if "returned True" in message or "returned Detection(" in message:
+                    times.setdefault("first_detection", t)
+        elif message.startswith("Connected to drone"):
+            times.setdefault("connect", t)
+        elif message.startswith("Global position estimate OK"):
+            times.setdefault("global_position", t)
+        elif message.startswith("Mission altitude reached"):
+            times.setdefault("altitude", t)
+        elif message.startswith("Taking image"):
+            times.setdefault("first_image", t)
+        elif decision is None and message.startswith("Obstacle identified"):
+            decision = "obstacle"
+            times["decision_time"] = t
+        elif decision is None and message.startswith("Mast found"):
+            decision = "mast"
+            times["decision_time"] = t
+    if start is None:
+        return None
+    return Timeline(
+        log=os.path.basename(path),
+        start=start,
+        duration=t,
+        connect=times.get("connect"),
+        global_position=times.get("global_position"),
+        altitude=times.get("altitude"),
+        first_image=times.get("first_image"),
+        first_detection=times.get("first_detection"),
+        decision=decision,
+        decision_time=times.get("decision_time"),
+        images=images,
+        inference_latency=float(np.mean(latencies)) if latencies else None,
+    )
+
+
+def _load_cache(path: str) -> Dict[str, dict]:
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache["logs"]
+
+
+def _save_cache(path: str, entries: Dict[str, dict]):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": CACHE_VERSION, "logs": entries}, f)
+    os.replace(tmp, path)
+
+
+def analyze_logs(
+    paths: List[str], workers: Optional[int] = None, cache_path: Optional[str] = None
+) -> List[Timeline]:
+    """
+    Extract the timelines of many logs, in parallel.
+
+    Timelines are cached per log in cache_path, and only extracted again when
+    the log changes.
+
+    :return: The timelines of the logs that are not empty, in the order of paths
+    """
+    cache = _load_cache(cache_path) if cache_path else {}
+    entries = {}
+    todo = []
+    for path in paths:
+        key = realpath(path)
+        stamp = source_stamp(path)
+        entry = cache.get(key)
+        if entry is not None and entry["stamp"] == stamp:
+            entries[key] = entry
+        else:
+            todo.append((key, stamp))
+
+    if todo:
+        logger.info(f"Parsing {len(todo)} logs, {len(paths) - len(todo)} are cached")
+        if len(todo) == 1 or workers == 1:
+            timelines = [analyze_log(key) for (key, _) in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                timelines = list(
+                    pool.map(
+                        analyze_log,
+                        [key for (key, _) in todo],
+                        chunksize=max(1, len(todo) // 64),
+                    )
+                )
+        for (key, stamp), timeline in zip(todo, timelines):
+            entries[key] = {
+                "stamp": stamp,
+                "timeline": timeline._asdict() if timeline is not None else None,
+            }
+        if cache_path:
+            _save_cache(cache_path, {**cache, **entries})
+
+    timelines = [entries[realpath(path)]["timeline"] for path in paths]
+    return [Timeline(**timeline) for timeline in timelines if timeline is not None]
+
+
+def summarize(timelines: List[Timeline]) -> str:
+    """Statistics of the times and inference latency over runs, and how the runs were decided"""
+    lines = [f"{len(timelines)} runs"]
+    columns = TIMES + ["inference_latency"]
+    width = max(len(column) for column in columns)
+    lines.append(
+        f"{'':<{width}}  {'runs':>5} {'mean':>8} {'median':>8} {'p90':>8} {'min':>8} {'max':>8}"
+    )
+    for column in columns:
+        values = np.array(
+            [getattr(t, column) for t in timelines if getattr(t, column) is not None],
+            dtype=np.float64,
+        )
+        if not len(values):
+            lines.append(f"{column:<{width}}  {0:>5}")
+            continue
+        stats = [
+            values.mean(),
+            np.median(values),
+            np.percentile(values, 90),
+            values.min(),
+            values.max(),
+        ]
+        lines.append(
+            f"{column:<{width}}  {len(values):>5} "
+            + " ".join(f"{v:>8.2f}" for v in stats)
+        )
+    decisions: Dict[str, int] = {}
+    for timeline in timelines:
+        decision = timeline.decision or "undecided"
+        decisions[decision] = decisions.get(decision, 0) + 1
+    lines.append(
+        "Decisions: "
+        + ", ".join(f"{name} {count}" for (name, count) in sorted(decisions.items()))
+    )
+    return "\n".join(lines)
+
+
+def write_timelines(path: str, timelines: List[Timeline]):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(Timeline._fields)
+        for timeline in timelines:
+            writer.writerow(["" if v is None else v for v in timeline])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Timelines of run_mission logs, and statistics of how long the phases of the runs took"
+    )
+    parser.add_argument(
+        "logs",
+        metavar="LOG",
+        nargs="*",
+        help="Logs written by run_mission.py, default=all logs in the logs directory",
+    )
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Processes to parse the logs with, default=number of CPUs",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="PATH",
+        default=None,
+        help=f"Where to cache the timelines, default={CACHE_NAME} in the directory of the first log",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Parse every log, and cache nothing"
+    )
+    parser.add_argument(
+        "--csv", metavar="PATH", default=None, help="Also write the timelines to a csv file"
+    )
+    config = parser.parse_args()
+
+    paths = config.logs or sorted(glob.glob(os.path.join(LOGS_PATH, "*.log")))
+    if not paths:
+        parser.error("No logs found")
+    cache_path = None
+    if not config.no_cache:
+        cache_path = config.cache or os.path.join(dirname(paths[0]), CACHE_NAME)
+
+    timelines = analyze_logs(paths, config.workers, cache_path)
+    for timeline in timelines:
+        print(
+            f"{timeline.log}: "
+            + ", ".join(
+                f"{column} {getattr(timeline, column):.1f} s"
+                for column in TIMES
+                if getattr(timeline, column) is not None
+            )
+            + f", {timeline.images} images, decision: {timeline.decision or 'none'}"
+        )
+    print(summarize(timelines))
+    if config.csv:
+        write_timelines(config.csv, timelines)
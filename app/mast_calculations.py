@@ -1,28 +1,42 @@
-import json
-from distance import haversine  # Returns distance in meters
+from mast_index import load_index
 from mastT import Mast
+from plan_sites import read_plan
 from typing import List, Tuple
 
+# How close (in degrees) an entry point must be to a planned point to use its masts
+PLAN_TOLERANCE_DEG = 1e-6
+
 
 def get_closest_masts(
     p: Tuple[float, float] = (10.573138, 55.369671), r: float = 4000, n: int = 3
 ) -> List[Tuple[Mast, float]]:
-    with open("mast_data.json", "r") as f:
-        data: List[Mast] = json.loads(f.read())
-    candidates = []
-    for mast in data:
-        d = haversine(
-            p,
-            (
-                float(mast["wgs84koordinat"]["laengde"]),
-                float(mast["wgs84koordinat"]["bredde"]),
-            ),
-        )
-        if d < r:
-            candidates.append((mast, d))
+    index = load_index()
+    return [(index.mast(i), d) for (i, d) in index.nearest(p, n, r)]
+
 
-    candidates = sorted(candidates, key=lambda cand: cand[1], reverse=False)
-    return candidates[:n]
+def get_planned_masts(
+    plan_path: str, p: Tuple[float, float], n: int = 3
+) -> List[Tuple[Mast, float]]:
+    """
+    Get the closest masts to a point from a plan written by plan_sites.py.
+    Falls back to get_closest_masts if the point is not in the plan.
+    """
+    rows = [
+        row
+        for row in read_plan(plan_path)
+        if abs(float(row["lon"]) - p[0]) <= PLAN_TOLERANCE_DEG
+        and abs(float(row["lat"]) - p[1]) <= PLAN_TOLERANCE_DEG
+    ]
+    if not rows:
+        return get_closest_masts(p, n=n)
+
+    store = load_index().store
+    if any(row["store_id"] != store.id for row in rows):
+        raise ValueError(
+            f"{plan_path} was planned with another version of the mast store, run plan_sites.py again"
+        )
+    rows = sorted(rows, key=lambda row: int(row["rank"]))[:n]
+    return [(store.mast(int(row["row"])), float(row["distance_m"])) for row in rows]
 
 
 if __name__ == "__main__":
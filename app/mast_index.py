@@ -0,0 +1,197 @@
+import os
+import pickle
+import threading
+from math import inf, sin
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from distance import EARTH_RADIUS_M, haversine_many, haversine_pairs
+from mast_store import MAST_DATA_PATH, MAST_STORE_PATH, MastStore, load_store
+from mastT import Mast
+
+MAST_INDEX_PATH = "mast_index.pkl"
+INDEX_VERSION = 2
+
+_index_cache: Dict[str, "MastIndex"] = {}
+_index_lock = threading.Lock()
+
+
+def to_unit_sphere(lon, lat) -> np.ndarray:
+    """
+    Convert gps coordinates (in decimal degrees) to points on the unit sphere.
+
+    :param lon: Longitude(s), (længdegrad)
+    :param lat: Latitude(s), (breddegrad)
+
+    :return: An (N, 3) array of cartesian coordinates
+    """
+    lon = np.radians(np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+    lat = np.radians(np.atleast_1d(np.asarray(lat, dtype=np.float64)))
+    cos_lat = np.cos(lat)
+    return np.stack(
+        (cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1
+    )
+
+
+def meters_to_chord(d: float) -> float:
+    """Straight-line distance on the unit sphere for a great circle distance in meters"""
+    if d == inf:
+        return inf
+    return 2 * sin(min(d / EARTH_RADIUS_M, np.pi) / 2)
+
+
+class MastIndex:
+    """
+    KD-tree over the mast positions of a mast store, on the unit sphere.
+
+    Euclidean distance on the unit sphere grows monotonically with the great
+    circle distance, so radius and k-nearest queries on the tree return the
+    same masts as a full scan with haversine, without looking at every mast.
+    """
+
+    def __init__(self, store: MastStore, tree: Optional[cKDTree] = None):
+        self.store = store
+        self.lon = store.lon
+        self.lat = store.lat
+        if tree is None:
+            tree = cKDTree(to_unit_sphere(self.lon, self.lat).reshape(-1, 3))
+        self.tree = tree
+
+    def __len__(self):
+        return len(self.store)
+
+    def mast(self, i: int) -> Mast:
+        return self.store.mast(i)
+
+    def distances(self, p: Tuple[float, float], idx: np.ndarray) -> np.ndarray:
+        """Haversine distance in meters from a point to the masts at the given indices"""
+        return haversine_many(p, np.stack((self.lon[idx], self.lat[idx]), axis=-1))
+
+    def within(self, p: Tuple[float, float], r: float) -> List[Tuple[int, float]]:
+        """
+        Find all masts closer than r meters to a point.
+
+        :param p: A gps point (longitude, latitude)
+        :param r: Search radius in meters
+
+        :return: (mast index, distance in meters) pairs, closest first
+        """
+        idx = np.asarray(
+            self.tree.query_ball_point(to_unit_sphere(*p)[0], meters_to_chord(r)),
+            dtype=np.intp,
+        )
+        if len(idx) == 0:
+            return []
+        d = self.distances(p, idx)
+        order = np.argsort(d, kind="stable")
+        return [(int(idx[i]), float(d[i])) for i in order if d[i] < r]
+
+    def nearest(
+        self, p: Tuple[float, float], k: int, r: float = inf
+    ) -> List[Tuple[int, float]]:
+        """
+        Find the k masts closest to a point, optionally limited to a radius.
+
+        :param p: A gps point (longitude, latitude)
+        :param k: Maximum number of masts to return
+        :param r: Search radius in meters
+
+        :return: (mast index, distance in meters) pairs, closest first
+        """
+        if k <= 0 or len(self) == 0:
+            return []
+        chord, idx = self.tree.query(
+            to_unit_sphere(*p)[0],
+            k=min(k, len(self)),
+            distance_upper_bound=meters_to_chord(r),
+        )
+        idx = np.atleast_1d(idx)[~np.isinf(np.atleast_1d(chord))]
+        d = self.distances(p, idx)
+        return [(int(i), float(dist)) for i, dist in zip(idx, d) if dist < r]
+
+    def nearest_many(
+        self, points, k: int, r: float = inf
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k masts closest to each of N points, in one vectorized query.
+
+        :param points: An (N, 2) array of gps points (longitude, latitude)
+        :param k: Maximum number of masts to return per point
+        :param r: Search radius in meters
+
+        :return: (N, k) arrays of mast indices and distances in meters, closest
+            first. Missing neighbours have index -1 and distance nan.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        idx = np.full((len(points), max(k, 0)), -1, dtype=np.intp)
+        d = np.full(idx.shape, np.nan)
+        if k <= 0 or len(self) == 0 or len(points) == 0:
+            return idx, d
+        kk = min(k, len(self))
+        chord, found = self.tree.query(
+            to_unit_sphere(points[:, 0], points[:, 1]),
+            k=kk,
+            distance_upper_bound=meters_to_chord(r),
+        )
+        chord = chord.reshape(len(points), kk)
+        found = found.reshape(len(points), kk)
+        valid = ~np.isinf(chord)
+        rows, cols = np.nonzero(valid)
+        masts = found[rows, cols]
+        dist = haversine_pairs(
+            points[rows], np.stack((self.lon[masts], self.lat[masts]), axis=-1)
+        )
+        keep = dist < r
+        idx[rows[keep], cols[keep]] = masts[keep]
+        d[rows[keep], cols[keep]] = dist[keep]
+        return idx, d
+
+
+def load_index(
+    data_path: str = MAST_DATA_PATH,
+    store_path: str = MAST_STORE_PATH,
+    index_path: Optional[str] = MAST_INDEX_PATH,
+) -> MastIndex:
+    """
+    Get the mast index for the mast store.
+
+    The index is kept in memory for the lifetime of the process, and its tree
+    is pickled to index_path so that later runs skip building it. The tree is
+    rebuilt whenever the store changes. Safe to call from several threads.
+
+    :param data_path: Path to the json dump written by fetch_data.py
+    :param store_path: Path to the mast store built from the json dump
+    :param index_path: Where to store the tree between runs, or None to not store it
+    """
+    # One thread at a time, so threads neither build the same tree nor write the same files
+    with _index_lock:
+        store = load_store(data_path, store_path)
+        index = _index_cache.get(store.path)
+        if index is not None and index.store is store:
+            return index
+
+        tree = None
+        if index_path and os.path.exists(index_path):
+            try:
+                with open(index_path, "rb") as f:
+                    stored = pickle.load(f)
+                if stored["version"] == INDEX_VERSION and stored["store"] == store.id:
+                    tree = stored["tree"]
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+                tree = None
+
+        index = MastIndex(store, tree)
+        if tree is None and index_path:
+            tmp_path = f"{index_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {"version": INDEX_VERSION, "store": store.id, "tree": index.tree},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, index_path)
+
+        _index_cache[store.path] = index
+        return index
@@ -0,0 +1,76 @@
+import math
+import threading
+
+import cv2
+import numpy as np
+
+from preprocessing import FramePreprocessor
+
+
+class MastPrefilter:
+    """
+    Cheap check whether a frame may show a mast, before the detector looks at it.
+
+    Masts are tall, (nearly) vertical structures. The edges of the frame are
+    found with Canny, and straight segments on them with the probabilistic
+    Hough transform. The score of a frame is the total length of the segments
+    within max_tilt degrees of vertical, relative to the height of the frame.
+    Frames of plain sky or fields score close to 0.
+
+    Can be used from several threads; every thread gets its own buffers, and
+    the passed/rejected counts are updated under a lock.
+
+    :param min_score: Frames scoring below this are rejected
+    :param max_tilt: Largest angle (degrees) between a segment and the vertical
+    :param min_length: Shortest segment, relative to the height of the frame
+    """
+
+    def __init__(
+        self,
+        min_score: float = 0.3,
+        max_tilt: float = 15,
+        min_length: float = 0.1,
+        canny_thresholds=(100, 200),
+    ):
+        self.min_score = min_score
+        self.tan_tilt = math.tan(math.radians(max_tilt))
+        self.min_length = min_length
+        self.canny_thresholds = canny_thresholds
+        self.passed = 0
+        self.rejected = 0
+        self._local = threading.local()
+        self._count_lock = threading.Lock()
+
+    def score(self, frame: np.ndarray) -> float:
+        preprocessor = getattr(self._local, "preprocessor", None)
+        if preprocessor is None:
+            preprocessor = self._local.preprocessor = FramePreprocessor()
+        edges = preprocessor.canny(
+            preprocessor.grayscale(frame), *self.canny_thresholds
+        )
+        height = edges.shape[0]
+        lines = cv2.HoughLinesP(
+            edges,
+            rho=1,
+            theta=np.pi / 180,
+            threshold=30,
+            minLineLength=max(1, int(self.min_length * height)),
+            maxLineGap=5,
+        )
+        if lines is None:
+            return 0.0
+        x1, y1, x2, y2 = lines.reshape(-1, 4).T.astype(np.float64)
+        dx = np.abs(x2 - x1)
+        dy = np.abs(y2 - y1)
+        vertical = dx <= dy * self.tan_tilt
+        return float(np.hypot(dx, dy)[vertical].sum() / height)
+
+    def passes(self, frame: np.ndarray) -> bool:
+        """Whether the frame should be checked by the detector"""
+        passed = self.score(frame) >= self.min_score
+        with self._count_lock:
+            if passed:
+                self.passed += 1
+            else:
+                self.rejected += 1
+        return passed
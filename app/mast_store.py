@@ -0,0 +1,306 @@
+import json
+import os
+import shutil
+import uuid
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from mastT import Mast
+
+MAST_DATA_PATH = "mast_data.json"
+MAST_STORE_PATH = "mast_store"
+STORE_VERSION = 2
+
+_store_cache: Dict[str, "MastStore"] = {}
+
+
+def source_stamp(path: str) -> List[int]:
+    """Identifies a version of a file, used to tell when derived data is stale"""
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _intern(values: Sequence[Hashable]) -> Tuple[List, np.ndarray]:
+    vocabulary: Dict[Hashable, int] = {}
+    codes = np.fromiter(
+        (vocabulary.setdefault(v, len(vocabulary)) for v in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return list(vocabulary), codes
+
+
+def _pack_strings(values: Sequence[bytes]) -> Tuple[bytes, np.ndarray]:
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    return b"".join(values), offsets
+
+
+def encode_record(mast: Mast) -> bytes:
+    """The compact json a mast record is stored as"""
+    return json.dumps(mast, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _write_rows(
+    path: str,
+    lon: np.ndarray,
+    lat: np.ndarray,
+    technologies: Sequence[Tuple[str, str]],
+    bands: Sequence[str],
+    names: Sequence[bytes],
+    records: Sequence[bytes],
+    source: Optional[dict],
+):
+    technology_vocabulary, technology_codes = _intern(technologies)
+    band_vocabulary, band_codes = _intern(bands)
+    names_blob, name_offsets = _pack_strings(names)
+    records_blob, record_offsets = _pack_strings(records)
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "lon.npy"), np.asarray(lon, dtype=np.float64))
+    np.save(os.path.join(tmp_path, "lat.npy"), np.asarray(lat, dtype=np.float64))
+    np.save(os.path.join(tmp_path, "technology.npy"), technology_codes)
+    np.save(os.path.join(tmp_path, "band.npy"), band_codes)
+    np.save(os.path.join(tmp_path, "name_offsets.npy"), name_offsets)
+    np.save(os.path.join(tmp_path, "record_offsets.npy"), record_offsets)
+    with open(os.path.join(tmp_path, "names.bin"), "wb") as f:
+        f.write(names_blob)
+    with open(os.path.join(tmp_path, "records.bin"), "wb") as f:
+        f.write(records_blob)
+    _write_meta(
+        tmp_path,
+        {
+            "version": STORE_VERSION,
+            "id": uuid.uuid4().hex,
+            "count": len(records),
+            "technologies": [navn for (_, navn) in technology_vocabulary],
+            "technology_ids": [id for (id, _) in technology_vocabulary],
+            "bands": band_vocabulary,
+            "source": source or {},
+        },
+    )
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    _store_cache.pop(os.path.abspath(path), None)
+
+
+def _write_meta(path: str, meta: dict):
+    tmp_path = os.path.join(path, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+
+def write_store(
+    masts: Sequence[Mast], path: str = MAST_STORE_PATH, source: Optional[dict] = None
+):
+    """
+    Write masts to a columnar store.
+
+    The store is a directory with one file per column, so each column can be
+    memory-mapped on its own:
+        lon.npy, lat.npy        float64 coordinates
+        technology.npy          code into meta["technologies"] and meta["technology_ids"]
+        band.npy                code into meta["bands"]
+        name_offsets.npy        offsets into names.bin (unik_station_navn)
+        record_offsets.npy      offsets into records.bin (the full Mast as compact json)
+
+    The directory is replaced as a whole, so readers never see a half-written store.
+
+    :param masts: The mast records, as returned by mastedatabasen.dk
+    :param path: Directory to write the store to
+    :param source: Extra information about where the masts came from, stored in the metadata
+    """
+    _write_rows(
+        path,
+        lon=[float(mast["wgs84koordinat"]["laengde"]) for mast in masts],
+        lat=[float(mast["wgs84koordinat"]["bredde"]) for mast in masts],
+        technologies=[
+            (mast["teknologi"]["id"], mast["teknologi"]["navn"]) for mast in masts
+        ],
+        bands=[mast["frekvensbaand"] for mast in masts],
+        names=[mast["unik_station_navn"].encode("utf-8") for mast in masts],
+        records=[encode_record(mast) for mast in masts],
+        source=source,
+    )
+
+
+def update_store(
+    store: "MastStore",
+    keep: Sequence[int],
+    added: Sequence[Mast],
+    source: Optional[dict] = None,
+):
+    """
+    Rewrite a store with some of its rows and some new masts.
+
+    Kept rows are copied over as stored, so only the added masts are encoded.
+
+    :param store: The store to update
+    :param keep: Indices of the rows of store to keep
+    :param added: New masts to add after the kept rows
+    :param source: New source metadata, or None to keep the current one
+    """
+    keep = np.asarray(keep, dtype=np.intp)
+    _write_rows(
+        store.path,
+        lon=np.concatenate(
+            (store.lon[keep], [float(m["wgs84koordinat"]["laengde"]) for m in added])
+        ),
+        lat=np.concatenate(
+            (store.lat[keep], [float(m["wgs84koordinat"]["bredde"]) for m in added])
+        ),
+        technologies=[
+            (store.technology_ids[c], store.technologies[c])
+            for c in store.technology[keep]
+        ]
+        + [(m["teknologi"]["id"], m["teknologi"]["navn"]) for m in added],
+        bands=[store.bands[c] for c in store.band[keep]]
+        + [m["frekvensbaand"] for m in added],
+        names=[store.raw_name(i) for i in keep]
+        + [m["unik_station_navn"].encode("utf-8") for m in added],
+        records=[store.raw_record(i) for i in keep] + [encode_record(m) for m in added],
+        source=store.source if source is None else source,
+    )
+
+
+def _map_bytes(path: str) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class MastStore:
+    """
+    Read-only, memory-mapped view of a store written by write_store.
+
+    Opening a store only reads the metadata; columns are paged in by the OS as
+    they are used, and full Mast records are only decoded for the masts asked for.
+    """
+
+    def __init__(self, path: str = MAST_STORE_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(
+                f"Mast store {path} has version {self.meta['version']}, expected {STORE_VERSION}"
+            )
+        self.technologies: List[str] = self.meta["technologies"]
+        self.technology_ids: List[str] = self.meta["technology_ids"]
+        self.bands: List[str] = self.meta["bands"]
+
+        def column(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.lon = column("lon")
+        self.lat = column("lat")
+        self.technology = column("technology")
+        self.band = column("band")
+        self._name_offsets = column("name_offsets")
+        self._record_offsets = column("record_offsets")
+        self._names = _map_bytes(os.path.join(path, "names.bin"))
+        self._records = _map_bytes(os.path.join(path, "records.bin"))
+
+    def __len__(self):
+        return self.meta["count"]
+
+    @property
+    def id(self) -> str:
+        """Unique for every write of a store"""
+        return self.meta["id"]
+
+    @property
+    def source(self) -> dict:
+        return self.meta["source"]
+
+    def set_source(self, source: dict):
+        """Replace the source metadata, without rewriting the columns"""
+        self.meta["source"] = source
+        _write_meta(self.path, self.meta)
+
+    def raw_name(self, i: int) -> bytes:
+        start, end = self._name_offsets[i], self._name_offsets[i + 1]
+        return self._names[start:end].tobytes()
+
+    def raw_record(self, i: int) -> bytes:
+        start, end = self._record_offsets[i], self._record_offsets[i + 1]
+        return self._records[start:end].tobytes()
+
+    def name(self, i: int) -> str:
+        """The unik_station_navn of mast i"""
+        return self.raw_name(i).decode("utf-8")
+
+    def mast(self, i: int) -> Mast:
+        """The full record of mast i"""
+        return json.loads(self.raw_record(i))
+
+    def masts(self, idx: Sequence[int]) -> List[Mast]:
+        return [self.mast(i) for i in idx]
+
+
+def build_store(
+    data_path: str = MAST_DATA_PATH, store_path: str = MAST_STORE_PATH
+) -> MastStore:
+    """Convert the json dump written by fetch_data.py to a mast store"""
+    with open(data_path, "r") as f:
+        masts: List[Mast] = json.loads(f.read())
+    write_store(
+        masts,
+        store_path,
+        source={"path": os.path.abspath(data_path), "stamp": source_stamp(data_path)},
+    )
+    return open_store(store_path)
+
+
+def open_store(store_path: str = MAST_STORE_PATH) -> MastStore:
+    """Open a mast store, reusing an already open one in this process"""
+    key = os.path.abspath(store_path)
+    store = _store_cache.get(key)
+    if store is None:
+        store = _store_cache[key] = MastStore(store_path)
+    return store
+
+
+def load_store(
+    data_path: str = MAST_DATA_PATH, store_path: str = MAST_STORE_PATH
+) -> MastStore:
+    """
+    Get the mast store, (re)building it from the json dump if that has changed.
+
+    If there is no json dump, the existing store is used as is. A store made
+    by fetch_data.py --sync is used unless the json dump was written after it.
+    """
+    try:
+        stamp = source_stamp(data_path)
+    except FileNotFoundError:
+        return open_store(store_path)
+
+    def is_current(store: MastStore) -> bool:
+        if "path" not in store.source and "sync" in store.source:
+            # Created by fetch_data.py --sync, which does not write a json dump
+            try:
+                return stamp[0] <= os.stat(store_path).st_mtime_ns
+            except FileNotFoundError:
+                return False
+        return (
+            store.source.get("path") == os.path.abspath(data_path)
+            and store.source.get("stamp") == stamp
+        )
+
+    store = _store_cache.get(os.path.abspath(store_path))
+    if store is not None and is_current(store):
+        return store
+    # Another process may have rebuilt the store since it was opened here
+    _store_cache.pop(os.path.abspath(store_path), None)
+    try:
+        store = open_store(store_path)
+    except (OSError, ValueError, KeyError):
+        return build_store(data_path, store_path)
+    if not is_current(store):
+        return build_store(data_path, store_path)
+    return store
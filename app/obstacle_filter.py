@@ -0,0 +1,43 @@
+from collections import deque
+from statistics import median
+from typing import Deque
+
+
+class ObstacleFilter:
+    """
+    Decides from a stream of distance sensor readings whether something is in front of the drone.
+
+    Single noisy readings are ignored by taking the median of the last window
+    readings. Hysteresis keeps the decision from flapping when the median hovers
+    around the threshold: something is in front once the median drops below
+    trigger_distance, and stays there until the median rises above
+    release_distance.
+    """
+
+    def __init__(self, window: int, trigger_distance: float, release_distance: float):
+        if release_distance < trigger_distance:
+            raise ValueError("release_distance must not be below trigger_distance")
+        self.readings: Deque[float] = deque(maxlen=window)
+        self.trigger_distance = trigger_distance
+        self.release_distance = release_distance
+        self.blocked = False
+
+    def update(self, distance: float) -> bool:
+        """
+        Add a reading.
+
+        :return: Whether something is in front of the drone
+        """
+        self.readings.append(distance)
+        if len(self.readings) < self.readings.maxlen:
+            return self.blocked
+        filtered = median(self.readings)
+        if self.blocked:
+            self.blocked = filtered <= self.release_distance
+        else:
+            self.blocked = filtered < self.trigger_distance
+        return self.blocked
+
+    def reset(self):
+        self.readings.clear()
+        self.blocked = False
@@ -0,0 +1,256 @@
+"""
+Checks many candidate points with several drones at once.
+
+Every drone is a PX4 SITL instance: instance i sends MAVLink to port
+14540 + i, and its camera streams to port 5600 + i. Each drone gets its own
+mavsdk_server (port 50051 + i), video pipeline and MissionState, while a
+single detector and inference worker pool serve the cameras of all drones.
+
+The candidate points are split into one run of neighbouring points per
+drone. A drone flies from each of its points to their closest masts, and on
+to its next point. Start each SITL instance with its PX4_HOME at the first
+point of its drone, which is logged at startup.
+"""
+import argparse
+import asyncio
+import csv
+import sys
+from datetime import datetime
+from os.path import dirname, realpath
+from typing import List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+import run_mission as mission
+from inference import InferenceWorker
+from mast_index import load_index
+from plan_sites import read_plan, read_points
+from route_planning import plan_visit_order
+from telemetry_recorder import TelemetryRecorder
+
+LOG_FORMAT = "{time}\t| {level}\t| {file}:{function}:{line} \t- {message}>"
+
+
+def split_points(
+    points: List[Tuple[float, float]], drones: int
+) -> List[List[Tuple[float, float]]]:
+    """
+    Split candidate points among drones.
+
+    The points are ordered along a short route, and the route is cut into one
+    run of about the same number of points per drone, so every drone checks
+    points close to each other.
+
+    :return: The points of each drone, in the order they should be checked
+    """
+    if not points:
+        return [[] for _ in range(drones)]
+    order = [0] + [k + 1 for k in plan_visit_order(points[0], points[1:])]
+    return [
+        [points[k] for k in chunk]
+        for chunk in np.array_split(np.asarray(order, dtype=np.intp), drones)
+    ]
+
+
+async def fly(
+    state: mission.MissionState,
+    points: List[Tuple[float, float]],
+    detector_task: asyncio.Future,
+    plan_path: Optional[str] = None,
+    dem_path: Optional[str] = None,
+    continuous: bool = False,
+) -> List[Tuple[Tuple[float, float], bool]]:
+    """
+    Check the points of one drone, one after the other.
+
+    :return: Each point, and whether line of sight to a mast was confirmed from it
+    """
+    results = []
+    if not points:
+        return results
+    with logger.contextualize(drone=state.name):
+        video_task = mission.run_in_thread(mission.load_video, state)
+        drone = await mission.connect(state)
+        with state.phase("waiting for video and detector"):
+            state.video = await video_task
+            await detector_task
+
+        logger.info("Arming")
+        await drone.action.arm()
+        running_tasks = mission.start_monitoring(drone, state)
+        try:
+            for point in points:
+                masts = await mission.run_in_thread(
+                    mission.find_masts, point, plan_path, dem_path
+                )
+                found = await mission.check_point(drone, state, point, masts, continuous)
+                logger.info(
+                    f"Point {point[0]}, {point[1]} checked. Line of sight confirmed to mast: {found}"
+                )
+                results.append((point, found))
+        finally:
+            logger.info("Landing")
+            await drone.action.return_to_launch()
+            for task in running_tasks:
+                task.cancel()
+            await asyncio.gather(*running_tasks, return_exceptions=True)
+            state.telemetry.close()
+    return results
+
+
+async def orchestrate(
+    points: List[Tuple[float, float]],
+    states: List[mission.MissionState],
+    plan_path: Optional[str] = None,
+    dem_path: Optional[str] = None,
+    continuous: bool = False,
+) -> List[Tuple[Tuple[float, float], bool]]:
+    """
+    Check the points with all drones in parallel.
+
+    :return: Each point, and whether line of sight to a mast was confirmed from it
+    """
+
+    async def load_detector():
+        mission.detector = await mission.run_in_thread(mission.load_detector)
+
+    detector_task = asyncio.ensure_future(load_detector())
+    # Build or load the mast index once, before the drones look up the masts of their points
+    await mission.run_in_thread(load_index)
+    shares = split_points(points, len(states))
+    for state, share in zip(states, shares):
+        if share:
+            logger.info(
+                f"{state.name} checks {len(share)} points, starting at {share[0][0]}, {share[0][1]}"
+            )
+    results = await asyncio.gather(
+        *(
+            fly(state, share, detector_task, plan_path, dem_path, continuous)
+            for state, share in zip(states, shares)
+        )
+    )
+    logger.info("Startup times:\n" + mission.startup.report())
+    return [result for share in results for result in share]
+
+
+def write_results(path: str, results: List[Tuple[Tuple[float, float], bool]]):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["lon", "lat", "line_of_sight"])
+        for (point, found) in results:
+            writer.writerow([repr(float(point[0])), repr(float(point[1])), int(found)])
+
+
+def plan_points(path: str) -> List[Tuple[float, float]]:
+    """The candidate points of a plan written by plan_sites.py, in the order they were planned"""
+    points = {}
+    for row in read_plan(path):
+        points.setdefault(int(row["point"]), (float(row["lon"]), float(row["lat"])))
+    return [points[k] for k in sorted(points)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the line of sight from many candidate points with several drones at once"
+    )
+    parser.add_argument(
+        "--points",
+        metavar="POINTS",
+        default=None,
+        help="A csv file with lon and lat columns, or a GeoJSON file of points",
+    )
+    parser.add_argument(
+        "--plan",
+        metavar="PLAN",
+        default=None,
+        help="A plan made by plan_sites.py, whose points are checked (unless --points is given) with the planned masts",
+    )
+    parser.add_argument(
+        "--drones", default=2, type=int, help="Number of drones, default=2"
+    )
+    parser.add_argument(
+        "--inference-workers",
+        default=1,
+        type=int,
+        help="Threads running the detector for the cameras of all drones, default=1",
+    )
+    parser.add_argument(
+        "--dem",
+        metavar="GEOTIFF",
+        action="store",
+        default=None,
+        help="Skip masts that an elevation model (a GeoTIFF in longitude/latitude) shows are blocked by the terrain",
+    )
+    parser.add_argument(
+        "--continuous",
+        action="store_true",
+        help="Check images back-to-back, see run_mission.py",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="results.csv",
+        help="Where to write whether line of sight was confirmed from each point",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Only run the detector on frames with tall vertical structures, see run_mission.py",
+    )
+    config = parser.parse_args()
+    if config.prefilter:
+        from mast_prefilter import MastPrefilter
+
+        mission.prefilter = MastPrefilter()
+    if config.points:
+        points = [tuple(p) for p in read_points(config.points).tolist()]
+    elif config.plan:
+        points = plan_points(config.plan)
+    else:
+        parser.error("Give the points to check with --points or --plan")
+
+    # A log and telemetry per drone, named like the logs of run_mission.py
+    log_path = dirname(realpath(__file__)) + "/../logs/" + datetime.now().strftime(
+        "%Y-%m-%d_%H-%M-%S_%f"
+    )
+    logger.remove(0)
+    logger.add(
+        sys.stdout,
+        colorize=True,
+        format="<green>{time}</green>\t| {level}\t| {extra[drone]}\t| <cyan>{file}:{function}:{line}</cyan> \t- <lvl>{message}</lvl>",
+        level="INFO",
+        enqueue=True,
+    )
+    logger.configure(extra={"drone": ""})
+    states = []
+    for i in range(config.drones):
+        name = f"drone{i}"
+        logger.add(
+            f"{log_path}_{name}.log",
+            format=LOG_FORMAT,
+            level="DEBUG",
+            enqueue=True,
+            filter=lambda record, name=name: record["extra"].get("drone") == name,
+        )
+        states.append(
+            mission.MissionState(
+                name=name,
+                system_address=f"udp://:{14540 + i}",
+                server_port=50051 + i,
+                video_port=5600 + i,
+                telemetry=TelemetryRecorder(f"{log_path}_{name}.telemetry"),
+            )
+        )
+
+    mission.inference.close()
+    mission.inference = InferenceWorker(
+        mission.detect_mast, workers=config.inference_workers
+    )
+    results = asyncio.get_event_loop().run_until_complete(
+        orchestrate(points, states, config.plan, config.dem, config.continuous)
+    )
+    write_results(config.output, results)
+    logger.info(
+        f"Line of sight confirmed from {sum(found for (_, found) in results)} of {len(results)} points, see {config.output}"
+    )
@@ -0,0 +1,176 @@
+import argparse
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from mast_index import MAST_INDEX_PATH, load_index
+from mast_store import MAST_DATA_PATH, MAST_STORE_PATH, MastStore
+
+# Inputs with more points than this are split over a process pool
+CHUNK_SIZE = 50_000
+
+PLAN_COLUMNS = [
+    "point",
+    "lon",
+    "lat",
+    "rank",
+    "store_id",
+    "row",
+    "unik_station_navn",
+    "frekvensbaand",
+    "mast_lon",
+    "mast_lat",
+    "distance_m",
+]
+
+
+def read_points(path: str) -> np.ndarray:
+    """
+    Read candidate points from a csv or GeoJSON file.
+
+    A csv file needs a header with lon and lat columns. A GeoJSON file may be a
+    FeatureCollection, a single Feature or a bare geometry, of Point or
+    MultiPoint geometries.
+
+    :return: An (N, 2) array of gps points (longitude, latitude)
+    """
+    if path.lower().endswith((".json", ".geojson")):
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data["type"] == "FeatureCollection":
+            geometries = [feature["geometry"] for feature in data["features"]]
+        elif data["type"] == "Feature":
+            geometries = [data["geometry"]]
+        else:
+            geometries = [data]
+        points = []
+        for geometry in geometries:
+            if geometry["type"] == "Point":
+                points.append(geometry["coordinates"][:2])
+            elif geometry["type"] == "MultiPoint":
+                points.extend(c[:2] for c in geometry["coordinates"])
+            else:
+                raise ValueError(f"Unsupported geometry type {geometry['type']}")
+    else:
+        with open(path, "r", newline="") as f:
+            points = [(row["lon"], row["lat"]) for row in csv.DictReader(f)]
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def _nearest_chunk(
+    args: Tuple[np.ndarray, int, float, str, str, str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    points, n, r, data_path, store_path, index_path = args
+    # Every worker process loads the (pickled) index once, and reuses it for later chunks
+    index = load_index(data_path, store_path, index_path)
+    return index.nearest_many(points, n, r)
+
+
+def plan(
+    points: np.ndarray,
+    r: float = 4000,
+    n: int = 3,
+    workers: Optional[int] = None,
+    data_path: str = MAST_DATA_PATH,
+    store_path: str = MAST_STORE_PATH,
+    index_path: str = MAST_INDEX_PATH,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the n closest masts within r meters of every candidate point.
+
+    :param points: An (N, 2) array of gps points (longitude, latitude)
+    :param r: Search radius in meters
+    :param n: Number of masts per point
+    :param workers: Size of the process pool used for large inputs
+
+    :return: (N, n) arrays of mast indices (-1 if missing) and distances in meters
+    """
+    index = load_index(data_path, store_path, index_path)
+    if len(points) <= CHUNK_SIZE or workers == 1:
+        return index.nearest_many(points, n, r)
+
+    chunks = [
+        (points[i : i + CHUNK_SIZE], n, r, data_path, store_path, index_path)
+        for i in range(0, len(points), CHUNK_SIZE)
+    ]
+    logger.info(f"Planning {len(points)} points in {len(chunks)} chunks")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_nearest_chunk, chunks))
+    return (
+        np.concatenate([idx for idx, _ in results]),
+        np.concatenate([d for _, d in results]),
+    )
+
+
+def write_plan(
+    path: str, points: np.ndarray, idx: np.ndarray, d: np.ndarray, store: MastStore
+):
+    """Write one row per (point, mast), closest mast first. Points without masts get no rows."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(PLAN_COLUMNS)
+        for point, rank in zip(*np.nonzero(idx >= 0)):
+            row = idx[point, rank]
+            writer.writerow(
+                [
+                    point,
+                    repr(float(points[point, 0])),
+                    repr(float(points[point, 1])),
+                    rank,
+                    store.id,
+                    row,
+                    store.name(row),
+                    store.bands[store.band[row]],
+                    repr(float(store.lon[row])),
+                    repr(float(store.lat[row])),
+                    round(float(d[point, rank]), 3),
+                ]
+            )
+
+
+def read_plan(path: str) -> List[dict]:
+    """Read a plan written by write_plan"""
+    with open(path, "r", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the closest masts for many candidate points, for use with run_mission.py --plan"
+    )
+    parser.add_argument(
+        "points",
+        metavar="POINTS",
+        help="A csv file with lon and lat columns, or a GeoJSON file of points",
+    )
+    parser.add_argument(
+        "-o", "--output", default="plan.csv", help="Where to write the plan"
+    )
+    parser.add_argument(
+        "-r",
+        "--radius",
+        default=4000,
+        type=float,
+        help="Search radius in meters, default=4000",
+    )
+    parser.add_argument(
+        "-n", "--count", default=3, type=int, help="Masts per point, default=3"
+    )
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Processes to use for large inputs, default=number of CPUs",
+    )
+    config = parser.parse_args()
+
+    points = read_points(config.points)
+    idx, d = plan(points, config.radius, config.count, config.workers)
+    write_plan(config.output, points, idx, d, load_index().store)
+    logger.info(
+        f"Wrote {int((idx >= 0).sum())} masts for {len(points)} points to {config.output}"
+    )
@@ -0,0 +1,97 @@
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def get_channel(image: np.ndarray, channel: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Keep one channel of a color image, and set the others to 0.
+
+    :param out: Where to write the result (may be image itself), a new array by default
+    """
+    if out is None:
+        out = np.empty_like(image)
+    if out is not image:
+        out[..., channel] = image[..., channel]
+    for k in range(image.shape[-1]):
+        if k != channel:
+            out[..., k] = 0
+    return out
+
+
+class FramePreprocessor:
+    """
+    Classical preprocessing of video frames, into buffers that are reused from frame to frame.
+
+    The results of each step are kept in the attributes gray, mask and edges,
+    (height, width) uint8 arrays that are overwritten by the next frame. They
+    are allocated once, and again only when the size of the frames changes.
+    """
+
+    def __init__(self, shape: Optional[Tuple[int, int]] = None):
+        self.shape: Optional[Tuple[int, int]] = None
+        if shape is not None:
+            self._allocate(shape)
+
+    def _allocate(self, shape: Tuple[int, int]):
+        self.shape = shape
+        self.gray = np.empty(shape, dtype=np.uint8)
+        self.mask = np.empty(shape, dtype=np.uint8)
+        self.edges = np.empty(shape, dtype=np.uint8)
+
+    def _check(self, frame: np.ndarray):
+        if frame.shape[:2] != self.shape:
+            self._allocate(frame.shape[:2])
+
+    def grayscale(self, frame: np.ndarray) -> np.ndarray:
+        """Grayscale version of a BGR frame (or a copy of a grayscale frame)"""
+        self._check(frame)
+        if frame.ndim == 2:
+            np.copyto(self.gray, frame)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        return self.gray
+
+    def otsu(self, gray: np.ndarray) -> float:
+        """
+        Threshold a grayscale image into mask, at the threshold found with Otsu's method.
+
+        :return: The threshold
+        """
+        self._check(gray)
+        threshold, _ = cv2.threshold(
+            gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=self.mask
+        )
+        return threshold
+
+    def adaptive_threshold(
+        self, gray: np.ndarray, block_size: int = 21, c: float = 10
+    ) -> np.ndarray:
+        """Threshold a grayscale image into mask, against the mean of the block around each pixel"""
+        self._check(gray)
+        cv2.adaptiveThreshold(
+            gray,
+            255,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY,
+            block_size,
+            c,
+            dst=self.mask,
+        )
+        return self.mask
+
+    def canny(self, gray: np.ndarray, low: float = 100, high: float = 200) -> np.ndarray:
+        """Edges of a grayscale image (255 on edges, 0 elsewhere) into edges"""
+        self._check(gray)
+        cv2.Canny(gray, low, high, edges=self.edges)
+        return self.edges
+
+    def paint_edges(self, frame: np.ndarray, color=(0, 0, 0)) -> np.ndarray:
+        """Paint the last edges found by canny onto a BGR frame, in place"""
+        if not frame.flags.c_contiguous:
+            frame[self.edges != 0] = color
+            return frame
+        # Edges are sparse, so indexing just the edge pixels beats a full-frame mask
+        frame.reshape(-1, frame.shape[-1])[np.flatnonzero(self.edges)] = color
+        return frame
@@ -0,0 +1,625 @@
+"""
+Replays recorded (or synthetic) telemetry to the mission logic, without PX4 and Gazebo.
+
+ReplaySystem stands in for mavsdk.System: its telemetry streams play back the
+altitude and distance sensor readings of a run_mission log at the times they
+were logged, and its mission and action plugins only keep track of what they
+are asked to do. Run on an AcceleratedEventLoop, minutes of flight replay in
+seconds.
+
+    python replay.py ../logs/*.log --speed 200
+"""
+import argparse
+import asyncio
+import os
+import re
+import selectors
+import tempfile
+import time
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from telemetry_recorder import load_telemetry
+
+DEFAULT_POSITION = (10.573138, 55.369671)  # Lars Tyndskids mark, like run_mission
+DEFAULT_SPEED = 100
+
+# {time}\t| {level}\t| {file}:{function}:{line} \t- {message}>, as configured in run_mission
+LOG_LINE = re.compile(
+    r"^(?P<time>\S+)\t\| (?P<level>\w+)\t\| (?P<file>[^:]+):(?P<function>[^:]+):(?P<line>\d+) \t- (?P<message>.*)$"
+)
+NUMBER = r"([-+0-9.eE]+|nan|inf)"
+ALTITUDE_MESSAGE = re.compile(r"^Drone altitude: " + NUMBER)
+DISTANCE_MESSAGE = re.compile(
+    r"minimum_distance_m: " + NUMBER + r", maximum_distance_m: " + NUMBER
+    + r", current_distance_m: " + NUMBER
+)
+CONFIDENCE_MESSAGE = re.compile(r"confidence[:=] ?" + NUMBER)
+# Old logs: "image_contains_mast returned False, confidence: 0.67", decided with a threshold of its time
+DECISION_MESSAGE = re.compile(r"^image_contains_mast returned (True|False)")
+PASSING_CONFIDENCE = 1.0  # Replayed for images an old log decided contain a mast
+
+
+# The telemetry types, with the fields of their mavsdk.telemetry namesakes that run_mission uses
+class Position(NamedTuple):
+    latitude_deg: float
+    longitude_deg: float
+    absolute_altitude_m: float
+    relative_altitude_m: float
+
+
+class DistanceSensor(NamedTuple):
+    minimum_distance_m: float
+    maximum_distance_m: float
+    current_distance_m: float
+
+
+class Health(NamedTuple):
+    is_global_position_ok: bool
+    is_home_position_ok: bool
+
+
+class ConnectionState(NamedTuple):
+    is_connected: bool
+
+
+class MissionProgress(NamedTuple):
+    current: int
+    total: int
+
+
+class ReplayDetection(NamedTuple):
+    # The fields of detector.Detection, which cannot be imported without PyTorch
+    box: Tuple[float, float, float, float]
+    confidence: float
+
+
+class LogRecord(NamedTuple):
+    time: float  # Seconds since the epoch
+    level: str
+    file: str
+    function: str
+    line: int
+    message: str
+
+
+class Recording(NamedTuple):
+    """Telemetry of one run, with times in seconds since the drone was connected"""
+
+    positions: List[Tuple[float, Position]]
+    distances: List[Tuple[float, DistanceSensor]]
+    confidences: List[Optional[float]]  # Of each checked image in order, None if nothing was detected
+    duration: float  # Length of the run (seconds)
+    global_position_time: float = 0  # When the global position estimate became OK
+    # The first decision in the log: ("mast" or "obstacle", time), if any
+    outcome: Optional[Tuple[str, float]] = None
+
+
+def iter_log(path: str) -> Iterator[LogRecord]:
+    """
+    Read the records of a run_mission log one at a time.
+
+    Messages that span several lines are joined, and the closing '>' of the
+    log format is removed.
+    """
+    record: Optional[LogRecord] = None
+    lines: List[str] = []
+
+    def finish(record: LogRecord) -> LogRecord:
+        message = "\n".join([record.message, *lines])
+        lines.clear()
+        return record._replace(message=message.removesuffix(">"))
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            match = LOG_LINE.match(line)
+            if match is None:
+                lines.append(line)
+                continue
+            if record is not None:
+                yield finish(record)
+            lines.clear()
+            record = LogRecord(
+                time=datetime.fromisoformat(match["time"]).timestamp(),
+                level=match["level"],
+                file=match["file"],
+                function=match["function"],
+                line=int(match["line"]),
+                message=match["message"],
+            )
+    if record is not None:
+        yield finish(record)
+
+
+def read_log(path: str) -> List[LogRecord]:
+    """Read all records of a run_mission log, see iter_log"""
+    return list(iter_log(path))
+
+
+def recording_from_log(
+    path: str, position: Tuple[float, float] = DEFAULT_POSITION
+) -> Recording:
+    """
+    Telemetry of a run_mission log.
+
+    Missions record their telemetry in logs/<time>.telemetry, next to the
+    log, which is read if it exists. Older logs contain the altitude and
+    distance sensor messages instead. They do not contain the position of the
+    drone, so the replayed positions stay at the given (longitude, latitude).
+    The oldest logs do not contain the altitude either; for those the drone is
+    taken to be at mission altitude when the first image was taken. Old logs
+    record whether each image contained a mast rather than the detector
+    output, and that decision is replayed.
+    """
+    records = read_log(path)
+    if not records:
+        raise ValueError(f"{path} contains no log records")
+    t0 = records[0].time
+    positions = []
+    distances = []
+    confidences = []
+    global_position_time = 0
+    first_image_time = None
+    outcome = None
+    for record in records:
+        t = record.time - t0
+        message = record.message
+        if (match := ALTITUDE_MESSAGE.match(message)) is not None:
+            altitude = float(match[1])
+            positions.append((t, Position(position[1], position[0], altitude, altitude)))
+        elif (match := DISTANCE_MESSAGE.search(message)) is not None:
+            distances.append((t, DistanceSensor(*map(float, match.groups()))))
+        elif record.function in ("detect_mast", "image_contains_mast") and (
+            " returned " in message
+        ):
+            decision = DECISION_MESSAGE.match(message)
+            if decision is not None:
+                # Replay the logged decision, not a confidence the current threshold may judge differently
+                confidences.append(PASSING_CONFIDENCE if decision[1] == "True" else None)
+            else:
+                match = CONFIDENCE_MESSAGE.search(message)
+                confidences.append(float(match[1]) if match is not None else None)
+        elif message.startswith("Taking image") and first_image_time is None:
+            first_image_time = t
+        elif message.startswith("Global position estimate OK"):
+            global_position_time = t
+        elif outcome is None and message.startswith("Obstacle identified"):
+            outcome = ("obstacle", t)
+        elif outcome is None and message.startswith("Mast found"):
+            outcome = ("mast", t)
+    if not positions and first_image_time is not None:
+        altitude = float("inf")
+        positions.append(
+            (first_image_time, Position(position[1], position[0], altitude, altitude))
+        )
+    telemetry_path = os.path.splitext(path)[0] + ".telemetry"
+    if os.path.isdir(telemetry_path):
+        positions, distances, confidences = _recorded_telemetry(telemetry_path, t0)
+    return Recording(
+        positions,
+        distances,
+        confidences,
+        duration=records[-1].time - t0,
+        global_position_time=global_position_time,
+        outcome=outcome,
+    )
+
+
+def _recorded_telemetry(path: str, t0: float):
+    """Positions, distances and confidences recorded by a TelemetryRecorder, with times since t0"""
+    telemetry = load_telemetry(path)
+    offset = telemetry.start - t0
+    positions = [
+        (t + offset, Position(float(lat), float(lon), float(alt), float(alt)))
+        for (t, lon, lat, alt) in telemetry.position.tolist()
+    ]
+    distances = [
+        (t + offset, DistanceSensor(*values))
+        for (t, *values) in telemetry.distance.tolist()
+    ]
+    confidences = [
+        None if np.isnan(confidence) else confidence
+        for confidence in telemetry.inference["confidence"].tolist()
+    ]
+    return positions, distances, confidences
+
+
+def synthetic_recording(
+    duration: float = 120,
+    rate: float = 10,
+    altitude: float = 5,
+    climb_rate: float = 0.5,
+    takeoff_time: float = 5,
+    clear_distance: float = 421,
+    obstacles: List[Tuple[float, float, float]] = (),
+    confidences: List[Optional[float]] = (),
+    position: Tuple[float, float] = DEFAULT_POSITION,
+) -> Recording:
+    """
+    Telemetry of a made-up flight.
+
+    The drone takes off at takeoff_time and climbs at climb_rate to altitude.
+    The distance sensor reads clear_distance (what it reads in Gazebo when
+    nothing is in front of it), except during the obstacles.
+
+    :param duration: Length of the flight (seconds)
+    :param rate: Telemetry messages per second, of each stream
+    :param obstacles: (start time, end time, distance) of things in front of the drone
+    :param confidences: Detector confidences of the images that will be checked, in order
+    """
+    t = np.arange(0, duration, 1 / rate)
+    climbed = np.clip((t - takeoff_time) * climb_rate, 0, altitude)
+    distance = np.full(len(t), float(clear_distance))
+    for (start, end, d) in obstacles:
+        distance[(t >= start) & (t < end)] = d
+    return Recording(
+        positions=[
+            (float(ti), Position(position[1], position[0], float(a), float(a)))
+            for ti, a in zip(t, climbed)
+        ],
+        distances=[
+            (float(ti), DistanceSensor(1.0, 500.0, float(d)))
+            for ti, d in zip(t, distance)
+        ],
+        confidences=list(confidences),
+        duration=duration,
+    )
+
+
+class _ScaledSelector(selectors.DefaultSelector):
+    def __init__(self, speed: float):
+        super().__init__()
+        self.speed = speed
+
+    def select(self, timeout=None):
+        return super().select(None if timeout is None else timeout / self.speed)
+
+
+class AcceleratedEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock runs speed times faster than real time.
+
+    asyncio.sleep and every other timer of the loop finish speed times sooner,
+    while work on other threads (like the inference worker) takes as long as it
+    does.
+    """
+
+    def __init__(self, speed: float = DEFAULT_SPEED):
+        super().__init__(_ScaledSelector(speed))
+        self.speed = speed
+
+    def time(self) -> float:
+        return super().time() * self.speed
+
+
+async def _play(samples, t0: float):
+    """Yield the samples when they are due, skipping those sent before the subscription"""
+    loop = asyncio.get_running_loop()
+    subscribed = loop.time() - t0
+    for (t, sample) in samples:
+        if t < subscribed:
+            continue
+        delay = t0 + t - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield sample
+
+
+class _Core:
+    def __init__(self, system: "ReplaySystem"):
+        self._system = system
+
+    async def connection_state(self):
+        yield ConnectionState(is_connected=True)
+
+
+class _Telemetry:
+    def __init__(self, system: "ReplaySystem"):
+        self._system = system
+
+    def position(self):
+        return _play(self._system.recording.positions, self._system.t0)
+
+    def distance_sensor(self):
+        return _play(self._system.recording.distances, self._system.t0)
+
+    def health(self):
+        return _play(
+            [(self._system.recording.global_position_time, Health(True, True))],
+            self._system.t0,
+        )
+
+    async def in_air(self):
+        async for pos in self.position():
+            yield pos.relative_altitude_m > 0.5
+
+
+class _Mission:
+    """
+    Keeps track of the uploaded mission.
+
+    A started mission visits its items one after the other, taking
+    item_duration seconds for each.
+    """
+
+    def __init__(self, system: "ReplaySystem", item_duration: float):
+        self._system = system
+        self.item_duration = item_duration
+        self.items = []
+        self.started: Optional[float] = None
+        self.return_to_launch_after_mission = True
+
+    def _current(self) -> int:
+        if self.started is None:
+            return 0
+        elapsed = asyncio.get_running_loop().time() - self.started
+        return min(int(elapsed // self.item_duration), len(self.items))
+
+    async def upload_mission(self, mission_plan):
+        self._system.call("upload_mission")
+        self.items = list(mission_plan.mission_items)
+        self.started = None
+
+    async def start_mission(self):
+        self._system.call("start_mission")
+        self.started = asyncio.get_running_loop().time()
+
+    async def pause_mission(self):
+        self._system.call("pause_mission")
+
+    async def clear_mission(self):
+        self._system.call("clear_mission")
+        self.items = []
+        self.started = None
+
+    async def set_return_to_launch_after_mission(self, enable: bool):
+        self.return_to_launch_after_mission = enable
+
+    async def is_mission_finished(self) -> bool:
+        self._system.call("is_mission_finished")
+        return self.started is not None and self._current() >= len(self.items)
+
+    async def mission_progress(self):
+        last = None
+        while True:
+            progress = MissionProgress(self._current(), len(self.items))
+            if progress != last:
+                last = progress
+                yield progress
+            await asyncio.sleep(0.5)
+
+
+class _Action:
+    def __init__(self, system: "ReplaySystem"):
+        self._system = system
+
+    async def arm(self):
+        self._system.call("arm")
+
+    async def return_to_launch(self):
+        self._system.call("return_to_launch")
+
+
+class _Param:
+    def __init__(self, system: "ReplaySystem"):
+        self._system = system
+        self.values = {}
+
+    async def set_param_float(self, name: str, value: float):
+        self.values[name] = value
+
+
+class ReplaySystem:
+    """
+    Stand-in for mavsdk.System that replays a recording.
+
+    The telemetry streams start when connect is called. Every call to the
+    mission and action plugins is recorded in calls, as (time since connect, name).
+    """
+
+    def __init__(self, recording: Recording, item_duration: float = 30):
+        self.recording = recording
+        self.t0 = 0.0
+        self.calls: List[Tuple[float, str]] = []
+        self.core = _Core(self)
+        self.telemetry = _Telemetry(self)
+        self.mission = _Mission(self, item_duration)
+        self.action = _Action(self)
+        self.param = _Param(self)
+
+    async def connect(self, system_address: Optional[str] = None):
+        self.t0 = asyncio.get_running_loop().time()
+
+    def now(self) -> float:
+        """Seconds since connect, on the clock of the recording"""
+        return asyncio.get_running_loop().time() - self.t0
+
+    def call(self, name: str):
+        self.calls.append((self.now(), name))
+
+
+class ReplayVideo:
+    """Stand-in for Video, delivering black frames"""
+
+    def __init__(self, shape: Tuple[int, int, int] = (360, 640, 3)):
+        self.frame = np.zeros(shape, dtype=np.uint8)
+        self.frame_seq = 0
+
+    async def next_frame(self, after: Optional[int] = None):
+        self.frame_seq += 1
+        return self.frame_seq, self.frame.copy()
+
+
+class ReplayDetector:
+    """Stand-in for MastDetector, returning the recorded confidences in order"""
+
+    def __init__(self, confidences: List[Optional[float]]):
+        self.confidences = list(confidences)
+        self.calls = 0
+
+    def detect(self, frame: np.ndarray) -> Optional[ReplayDetection]:
+        confidence = None
+        if self.calls < len(self.confidences):
+            confidence = self.confidences[self.calls]
+        self.calls += 1
+        if confidence is None:
+            return None
+        h, w = frame.shape[:2]
+        return ReplayDetection(box=(0.0, 0.0, float(w), float(h)), confidence=confidence)
+
+
+class ReplayResult(NamedTuple):
+    # Times are seconds since connect, on the clock of the recording
+    altitude_reached: Optional[float]
+    obstacle: Optional[float]
+    mast_found: Optional[float]
+    images: int
+    rpc_calls: int  # Calls to the mission and action plugins
+    wall_time: float  # Seconds it took to replay
+
+    @property
+    def outcome(self) -> Optional[Tuple[str, float]]:
+        events = [("mast", self.mast_found), ("obstacle", self.obstacle)]
+        events = [(name, t) for (name, t) in events if t is not None]
+        return min(events, key=lambda event: event[1], default=None)
+
+
+async def replay_mission(
+    recording: Recording, continuous: bool = False, poll_interval: float = 0.1
+) -> ReplayResult:
+    """
+    Run the monitoring and recognition tasks of run_mission against a recording.
+
+    The replay ends at the first decision (a mast was found or an obstacle was
+    seen), or when the recording ends. Images the mission logged before it
+    stopped may not have been checked yet by then, as the replayed mission
+    does not take its images at exactly the recorded times; the replay goes on
+    while the detector keeps taking those images.
+    """
+    import run_mission as mission
+
+    start = time.perf_counter()
+    state = mission.MissionState()
+    state.video = ReplayVideo()
+    drone = ReplaySystem(recording)
+    detector = ReplayDetector(recording.confidences)
+    mission.detector = detector
+    mission.time_start = time.time()
+    await drone.connect()
+
+    tasks = mission.start_monitoring(drone, state) + [
+        asyncio.ensure_future(mission.do_mast_recognition(state, continuous))
+    ]
+    altitude_reached = obstacle = mast_found = None
+    calls, last_call = 0, 0.0  # Detector calls so far, and the time of the last
+    try:
+        while True:
+            if detector.calls != calls:
+                calls, last_call = detector.calls, drone.now()
+            if drone.now() > recording.duration + poll_interval and not (
+                calls < len(recording.confidences)
+                and drone.now() - last_call <= mission.RECOGNITION_INTERVAL + poll_interval
+            ):
+                break
+            if altitude_reached is None and state.mast_height_altitude_reached.is_set():
+                altitude_reached = drone.now()
+            if obstacle is None and state.obstacle_avoidance_triggered.is_set():
+                obstacle = drone.now()
+            if mast_found is None and state.has_found_mast.is_set():
+                mast_found = drone.now()
+            if obstacle is not None or mast_found is not None:
+                break
+            await asyncio.sleep(poll_interval)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return ReplayResult(
+        altitude_reached=altitude_reached,
+        obstacle=obstacle,
+        mast_found=mast_found,
+        images=detector.calls,
+        rpc_calls=len(drone.calls),
+        wall_time=time.perf_counter() - start,
+    )
+
+
+def replay(
+    recording: Recording, speed: float = DEFAULT_SPEED, continuous: bool = False
+) -> ReplayResult:
+    """Replay a recording on an AcceleratedEventLoop, see replay_mission"""
+    loop = AcceleratedEventLoop(speed)
+    cwd = os.getcwd()
+    # run_mission saves the checked images in images/, relative to the working directory
+    with tempfile.TemporaryDirectory() as tmp:
+        os.mkdir(os.path.join(tmp, "images"))
+        os.chdir(tmp)
+        try:
+            return loop.run_until_complete(replay_mission(recording, continuous))
+        finally:
+            os.chdir(cwd)
+            loop.close()
+
+
+def _format_outcome(outcome: Optional[Tuple[str, float]]) -> str:
+    if outcome is None:
+        return "no decision"
+    return f"{outcome[0]} at {outcome[1]:.1f} s"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay the telemetry of run_mission logs (or a synthetic flight) to the mission logic, and compare the decisions"
+    )
+    parser.add_argument(
+        "logs", metavar="LOG", nargs="*", help="Logs written by run_mission.py"
+    )
+    parser.add_argument(
+        "--speed",
+        action="store",
+        default=DEFAULT_SPEED,
+        type=float,
+        help=f"How many times faster than real time to replay, default={DEFAULT_SPEED}",
+    )
+    parser.add_argument(
+        "--continuous",
+        action="store_true",
+        help="Replay with continuous mast recognition",
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="Also replay a synthetic flight, with an obstacle after 60 seconds",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the log messages of run_mission"
+    )
+    config = parser.parse_args()
+
+    from loguru import logger
+
+    if not config.verbose:
+        logger.remove()
+
+    runs = [(path, recording_from_log) for path in config.logs]
+    if config.synthetic or not runs:
+        runs.append(
+            ("synthetic", lambda _: synthetic_recording(obstacles=[(60, 65, 120)]))
+        )
+    for (name, load) in runs:
+        try:
+            recording = load(name)
+        except ValueError as e:
+            print(f"{name}: {e}")
+            continue
+        result = replay(recording, config.speed, config.continuous)
+        print(
+            f"{name}: logged {_format_outcome(recording.outcome)}, "
+            f"replayed {_format_outcome(result.outcome)} "
+            f"({recording.duration:.0f} s of flight in {result.wall_time:.2f} s, "
+            f"{result.images} images, {result.rpc_calls} mission calls)"
+        )
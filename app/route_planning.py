@@ -0,0 +1,106 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from distance import haversine_matrix
+
+# Up to this many points, the shortest visit order is found exactly
+EXACT_LIMIT = 10
+
+
+def tour_length(dist: np.ndarray, order: Sequence[int]) -> float:
+    """
+    Length of the round trip from node 0 through the nodes in order and back to node 0.
+
+    :param dist: (n + 1, n + 1) distance matrix, where node 0 is the start
+    :param order: The nodes 1..n in the order they are visited
+    """
+    tour = [0, *order, 0]
+    return float(sum(dist[a, b] for a, b in zip(tour[:-1], tour[1:])))
+
+
+def _held_karp(dist: np.ndarray) -> List[int]:
+    """Exact shortest round trip, in O(2^n * n^2)"""
+    n = len(dist) - 1
+    full = (1 << n) - 1
+    # cost[mask, j]: shortest path from the start through the nodes in mask, ending at node j + 1
+    cost = np.full((1 << n, n), np.inf)
+    parent = np.full((1 << n, n), -1, dtype=np.intp)
+    for j in range(n):
+        cost[1 << j, j] = dist[0, j + 1]
+
+    for mask in range(1, full + 1):
+        for j in range(n):
+            if not mask & (1 << j) or np.isinf(cost[mask, j]):
+                continue
+            for k in range(n):
+                if mask & (1 << k):
+                    continue
+                c = cost[mask, j] + dist[j + 1, k + 1]
+                if c < cost[mask | (1 << k), k]:
+                    cost[mask | (1 << k), k] = c
+                    parent[mask | (1 << k), k] = j
+
+    last = int(np.argmin(cost[full] + dist[1:, 0]))
+    order = []
+    mask = full
+    while last != -1:
+        order.append(last + 1)
+        mask, last = mask & ~(1 << last), parent[mask, last]
+    return order[::-1]
+
+
+def _nearest_neighbour(dist: np.ndarray) -> List[int]:
+    unvisited = set(range(1, len(dist)))
+    order = []
+    current = 0
+    while unvisited:
+        current = min(unvisited, key=lambda k: dist[current, k])
+        unvisited.remove(current)
+        order.append(current)
+    return order
+
+
+def _two_opt(dist: np.ndarray, order: List[int]) -> List[int]:
+    """Reverse segments of the tour for as long as that makes it shorter"""
+    tour = [0, *order, 0]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(tour) - 2):
+            for j in range(i + 1, len(tour) - 1):
+                delta = (
+                    dist[tour[i - 1], tour[j]]
+                    + dist[tour[i], tour[j + 1]]
+                    - dist[tour[i - 1], tour[i]]
+                    - dist[tour[j], tour[j + 1]]
+                )
+                if delta < -1e-9:
+                    tour[i : j + 1] = tour[i : j + 1][::-1]
+                    improved = True
+    return tour[1:-1]
+
+
+def plan_visit_order(
+    start: Tuple[float, float], points: Sequence[Tuple[float, float]]
+) -> List[int]:
+    """
+    Order in which to visit points, to make the round trip from start as short as possible.
+
+    Exact for up to EXACT_LIMIT points, otherwise a nearest neighbour tour
+    improved with 2-opt.
+
+    :param start: A gps point (longitude, latitude) the round trip starts and ends at
+    :param points: The gps points (longitude, latitude) to visit
+
+    :return: Indices into points, in the order they should be visited
+    """
+    if len(points) <= 1:
+        return list(range(len(points)))
+    nodes = np.asarray([start, *points], dtype=np.float64)
+    dist = haversine_matrix(nodes, nodes)
+    if len(points) <= EXACT_LIMIT:
+        order = _held_karp(dist)
+    else:
+        order = _two_opt(dist, _nearest_neighbour(dist))
+    return [k - 1 for k in order]
@@ -1,240 +1,537 @@
+from timing import StartupTimer
+
+# Started before the other imports, so they are part of the startup report
+startup = StartupTimer()
+
 import asyncio
-from typing import List, Tuple
+import contextvars
+from typing import TYPE_CHECKING, List, Optional, Tuple
 import threading
 from mavsdk import System
-from mavsdk.mission import MissionItem, MissionPlan
-from mast_calculations import get_closest_masts
-from Video import Video
-import os
+from mavsdk.mission import MissionItem, MissionPlan, MissionProgress
+from mast_calculations import get_closest_masts, get_planned_masts
+from distance import haversine
+from mastT import Mast
+from route_planning import plan_visit_order
+from inference import InferenceWorker
+from obstacle_filter import ObstacleFilter
+from telemetry_recorder import TelemetryRecorder
 import argparse
-
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-from keras.applications.vgg16 import VGG16, preprocess_input, decode_predictions
-from keras.utils.image_utils import img_to_array
+import numpy as np
 from loguru import logger
 import sys
 import time
+from datetime import datetime
 from os.path import dirname, realpath
 
 # Image stuff
 from PIL import Image
 
+# The video pipeline (GStreamer) and the detector (PyTorch) are slow to import
+# and start, so they are only loaded by load_resources, once a mission runs.
+if TYPE_CHECKING:
+    from detector import Detection, MastDetector
+    from mast_prefilter import MastPrefilter
+    from Video import Video
+
+startup.record("imports", startup.t0, time.perf_counter())
+
 MAST_HEIGHT = 5  # Relative height of old mast to starting position of drone (meters)
 ACCEPTANCE_RADIUS = 5  # How close should the drone be to the mast before the mission is a success (meters)
-
-video = Video()
-model = VGG16()
+MAST_CONFIDENCE = 0.60  # Detector confidence needed to decide an image contains a mast
+RECOGNITION_INTERVAL = 5  # Seconds between images, unless recognition is continuous
+MAX_RECOGNITION_INTERVAL = 2  # Longest pause between images in continuous mode (seconds)
+NEAR_MAST_DISTANCE = 500  # Within this distance (meters) of the mast, images are checked back-to-back
+MAX_MASTS = 3  # How many of the closest masts to check
+ENTRY_POINT_RADIUS = 50  # A drone further than this (meters) from an entry point flies there first
+# For some reason, the documentation of the distance sensor is in meters,
+# but the data we get is certainly not meters.
+# Therefore, 400 meters here does not equal 400 meters in Gazebo.
+OBSTACLE_DISTANCE = 400  # Sensor reading below which something is in front of the drone
+OBSTACLE_CLEAR_DISTANCE = 410  # Sensor reading above which the way is clear again
+OBSTACLE_WINDOW = 3  # Number of sensor readings the obstacle decision is based on
+
+# Shared by the cameras of all drones
+detector: Optional["MastDetector"] = None
+# Optional cheap check that skips the detector for frames without tall vertical structures
+prefilter: Optional["MastPrefilter"] = None
 time_start = time.time()
 
-# Initialize thread-safe variables
-obstacle_avoidance_triggered = threading.Event()
-has_found_mast = threading.Event()
-is_returning = threading.Event()
-mast_height_altitude_reached = threading.Event()
 
+class MissionState:
+    """
+    The state of the mission of one drone, shared by the tasks that fly and monitor it.
+
+    :param name: Name of the drone, empty if there is only one
+    :param system_address: Where the drone (PX4) sends MAVLink messages to
+    :param server_port: Port of the mavsdk_server of the drone
+    :param video_port: Port the camera of the drone streams to
+    :param telemetry: Where to record the telemetry, by default it is not written to disk
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        system_address: str = "udp://:14540",
+        server_port: int = 50051,
+        video_port: int = 5600,
+        telemetry: Optional[TelemetryRecorder] = None,
+    ):
+        self.name = name
+        self.system_address = system_address
+        self.server_port = server_port
+        self.video_port = video_port
+        self.video: Optional["Video"] = None
+
+        # Initialize thread-safe variables
+        self.obstacle_avoidance_triggered = threading.Event()
+        self.has_found_mast = threading.Event()
+        self.is_returning = threading.Event()
+        self.mast_height_altitude_reached = threading.Event()
+
+        # Latest (longitude, latitude) of the drone, and of the mast it is flying to
+        self.drone_position: Optional[Tuple[float, float]] = None
+        self.target_position: Optional[Tuple[float, float]] = None
+
+        # Index of the mission item the drone is flying to, and the number of items
+        self.mission_progress = MissionProgress(current=-1, total=0)
+
+        # Position, distance sensor and inference results at full rate, instead of a log message each
+        self.telemetry = telemetry if telemetry is not None else TelemetryRecorder()
+
+    def phase(self, name: str):
+        """A startup phase of this drone"""
+        return startup.phase(f"{self.name} {name}" if self.name else name)
+
+    def is_mission_finished(self) -> bool:
+        """Whether the current mission is finished, from the latest mission progress"""
+        return 0 < self.mission_progress.total <= self.mission_progress.current
+
+    def image_path(self, i: int) -> str:
+        prefix = f"{self.name}_" if self.name else ""
+        return f"images/{prefix}second_{i}.jpeg"
+
+
+def load_video(state: MissionState) -> "Video":
+    with state.phase("video"):
+        from Video import Video
+
+        # Scale the (16:9) camera frames down to the input width of the detector in the video pipeline
+        return Video(port=state.video_port, size=(640, 360))
+
+
+def load_detector() -> "MastDetector":
+    with startup.phase("detector"):
+        from detector import MastDetector
+
+        return MastDetector()  # Loads and warms up the hotair-baloon YOLOv5 model
+
+
+def run_in_thread(func, *args) -> asyncio.Future:
+    """
+    Run a blocking function on the default executor of the running loop.
+
+    The function runs in a copy of the caller's context, so what it logs keeps the
+    drone name of the caller (run_in_executor does not copy contextvars).
+    """
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(None, context.run, func, *args)
+
+
+async def load_resources(state: MissionState):
+    """Start the video pipeline and load the detector, in parallel on worker threads"""
+    global detector
+    state.video, detector = await asyncio.gather(
+        run_in_thread(load_video, state), run_in_thread(load_detector)
+    )
+
+
+def find_masts(
+    entry_point: Tuple[float, float],
+    plan_path: Optional[str] = None,
+    dem_path: Optional[str] = None,
+):
+    with startup.phase("masts"):
+        # Should be received from the base-station in real setup
+        if plan_path:
+            closest_masts = get_planned_masts(plan_path, entry_point)
+        else:
+            closest_masts = get_closest_masts(entry_point)
 
-async def run(entry_point: Tuple[float, float]):
-    drone = System()
+        if dem_path:
+            from line_of_sight import ElevationModel, screen_masts
+
+            closest_masts, blocked_masts = screen_masts(
+                ElevationModel(dem_path),
+                entry_point,
+                closest_masts,
+                observer_height=MAST_HEIGHT,
+                target_height=MAST_HEIGHT,
+            )
+            for (mast, _) in blocked_masts:
+                logger.info(
+                    f"Skipping mast {mast['unik_station_navn']}, the terrain blocks line of sight"
+                )
+        return closest_masts
+
+
+async def connect(state: MissionState) -> System:
+    """Connect to the drone, wait for its position estimate and configure it"""
+    drone = System(port=state.server_port)
+
+    with state.phase("connect"):
+        await drone.connect(system_address=state.system_address)
+
+        logger.info("Waiting for drone to connect...")
+        async for connection in drone.core.connection_state():
+            if connection.is_connected:
+                logger.info(f"Connected to drone!")
+                break
+
+    with state.phase("global position"):
+        logger.info("Waiting for drone to have a global position estimate...")
+        async for health in drone.telemetry.health():
+            if health.is_global_position_ok and health.is_home_position_ok:
+                logger.info("Global position estimate OK")
+                break
+
+    with state.phase("parameters"):
+        # Configure the drone parameters
+        await drone.param.set_param_float("MIS_DIST_1WP", 5000)
+        await drone.param.set_param_float("MIS_DIST_WPS", 5000)
+        await drone.mission.set_return_to_launch_after_mission(False)
+    return drone
+
+
+def start_monitoring(drone: System, state: MissionState) -> List[asyncio.Future]:
+    """Start the tasks that follow the telemetry and mission progress of the drone"""
+    return [
+        asyncio.ensure_future(monitor_distance(drone, state)),
+        asyncio.ensure_future(monitor_altitude(drone, state)),
+        asyncio.ensure_future(monitor_position(drone, state)),
+        asyncio.ensure_future(monitor_mission_progress(drone, state)),
+    ]
 
-    closest_masts = get_closest_masts(
-        entry_point
-    )  # Should be received from the base-station in real setup
-    await drone.connect(system_address="udp://:14540")
 
-    logger.info("Waiting for drone to connect...")
-    async for state in drone.core.connection_state():
-        if state.is_connected:
-            logger.info(f"Connected to drone!")
-            break
+async def run(
+    entry_point: Tuple[float, float],
+    plan_path: Optional[str] = None,
+    dem_path: Optional[str] = None,
+    continuous: bool = False,
+    state: Optional[MissionState] = None,
+):
+    if state is None:
+        state = MissionState()
 
-    logger.info("Waiting for drone to have a global position estimate...")
-    async for health in drone.telemetry.health():
-        if health.is_global_position_ok and health.is_home_position_ok:
-            logger.info("Global position estimate OK")
-            break
+    # Load everything that is not needed to talk to the drone while it connects
+    resources_task = asyncio.ensure_future(load_resources(state))
+    masts_task = run_in_thread(find_masts, entry_point, plan_path, dem_path)
 
-    # Configure the drone parameters
-    await drone.param.set_param_float("MIS_DIST_1WP", 5000)
-    await drone.param.set_param_float("MIS_DIST_WPS", 5000)
-    await drone.mission.set_return_to_launch_after_mission(False)
+    drone = await connect(state)
+
+    with state.phase("waiting for masts, video and detector"):
+        closest_masts = await masts_task
+        await resources_task
+    logger.info("Startup times:\n" + startup.report())
 
     logger.info("Arming")
     await drone.action.arm()
 
     # Start parallel tasks
-    monitor_distance_task = asyncio.ensure_future(monitor_distance(drone))
-    do_mast_recognition_task = asyncio.ensure_future(do_mast_recognition())
-    monitor_altitude_task = asyncio.ensure_future(monitor_altitude(drone))
-
-    running_tasks = [
-        monitor_distance_task,
-        do_mast_recognition_task,
-        monitor_altitude_task,
-    ]
+    running_tasks = start_monitoring(drone, state)
 
-    mission_items = []
-    for (mast, _) in closest_masts:
-        mission_items.append(
-            MissionItem(
-                latitude_deg=float(mast["wgs84koordinat"]["bredde"]),
-                longitude_deg=float(mast["wgs84koordinat"]["laengde"]),
-                relative_altitude_m=MAST_HEIGHT,
-                speed_m_s=3,
-                is_fly_through=False,
-                gimbal_pitch_deg=45,
-                gimbal_yaw_deg=float("nan"),
-                camera_action=MissionItem.CameraAction.NONE,
-                loiter_time_s=float("nan"),
-                camera_photo_interval_s=float("nan"),
-                acceptance_radius_m=ACCEPTANCE_RADIUS,
-                yaw_deg=float("nan"),
-                camera_photo_distance_m=float("nan"),
-            )
-        )
+    await check_point(drone, state, entry_point, closest_masts, continuous)
+    logger.info("Landing")
+    await drone.action.return_to_launch()
 
-    i = 0
-    while not has_found_mast.is_set() and i < 3 and i < len(mission_items):
 
-        mission_plan = MissionPlan([mission_items[i]])
+async def check_point(
+    drone: System,
+    state: MissionState,
+    entry_point: Tuple[float, float],
+    closest_masts: List[Tuple[Mast, float]],
+    continuous: bool = False,
+) -> bool:
+    """
+    Check the line of sight from an entry point to its closest masts.
+
+    A drone that is elsewhere first flies to the entry point. Afterwards, it
+    waits at the entry point.
+
+    :return: Whether line of sight to a mast was confirmed
+    """
+    state.has_found_mast.clear()
+    while state.drone_position is None:
+        await asyncio.sleep(0.1)
+    if haversine(state.drone_position, entry_point) > ENTRY_POINT_RADIUS:
+        logger.info(f"Flying to entry point {entry_point[0]}, {entry_point[1]}")
+        await return_to_entry(drone, state, entry_point)
+        state.is_returning.clear()
+
+    do_mast_recognition_task = asyncio.ensure_future(
+        do_mast_recognition(state, continuous)
+    )
+
+    remaining = [mast for (mast, _) in closest_masts[:MAX_MASTS]]
+    while not state.has_found_mast.is_set() and remaining:
+        # Visit the masts in the order that makes the round trip from the entry point shortest
+        order = plan_visit_order(entry_point, [mast_position(mast) for mast in remaining])
+        remaining = [remaining[k] for k in order]
+
+        # Fly to every remaining mast in one mission, ending back at the entry point
+        mission_plan = MissionPlan(
+            [mast_mission_item(mast) for mast in remaining]
+            + [entry_mission_item(entry_point)]
+        )
 
-        logger.info(f"Uploading mission {i}")
+        logger.info(f"Uploading mission with {len(remaining)} masts")
         await drone.mission.upload_mission(mission_plan)
 
         await asyncio.sleep(1)
 
         logger.info("Starting mission")
+        state.mission_progress.current = -1  # Until the progress of this mission arrives
         await drone.mission.start_mission()
 
-        logger.info(
-            f"Now checking mast {closest_masts[i][0]['unik_station_navn']} at {closest_masts[i][0]['wgs84koordinat']['laengde']}, {closest_masts[i][0]['wgs84koordinat']['bredde']}"
-        )
-
-        while not has_found_mast.is_set() and not obstacle_avoidance_triggered.is_set():
+        current = -1
+        is_finished = False
+        while (
+            not state.has_found_mast.is_set()
+            and not state.obstacle_avoidance_triggered.is_set()
+            and not is_finished
+        ):
+            if state.mission_progress.current != current:
+                current = state.mission_progress.current
+                if current < len(remaining):
+                    state.target_position = mast_position(remaining[current])
+                    logger.info(
+                        f"Now checking mast {remaining[current]['unik_station_navn']} at {state.target_position[0]}, {state.target_position[1]}"
+                    )
+                else:
+                    state.target_position = None
+                    state.is_returning.set()
+                    logger.info("All masts checked, returning to base")
             await asyncio.sleep(1)
+            is_finished = await drone.mission.is_mission_finished()
 
-        if obstacle_avoidance_triggered.is_set():
+        if state.has_found_mast.is_set() or state.obstacle_avoidance_triggered.is_set():
+            if state.obstacle_avoidance_triggered.is_set():
+                # Return the way we came, and plan the masts that are left from there
+                remaining = remaining[max(current, 0) + 1 :]
             logger.info("Clearing current mission")
             await drone.mission.pause_mission()
             await drone.mission.clear_mission()
+            await return_to_entry(drone, state, entry_point)
+        else:
+            remaining = []
 
-        logger.info("Returning to base")
-        is_returning.set()
-        obstacle_avoidance_triggered.clear()
-        await drone.mission.clear_mission()
-        await drone.mission.upload_mission(
-            MissionPlan(
-                [
-                    MissionItem(
-                        float(entry_point[1]),
-                        float(entry_point[0]),
-                        MAST_HEIGHT,
-                        3,
-                        False,
-                        float("nan"),
-                        float("nan"),
-                        MissionItem.CameraAction.NONE,
-                        float("nan"),
-                        float("nan"),
-                        float("nan"),
-                        float("nan"),
-                        float("nan"),
-                    )
-                ]
-            )
-        )
-        await asyncio.sleep(1)
-        await drone.mission.start_mission()
-        is_finished = False
-        while not is_finished:
-            is_finished = await drone.mission.is_mission_finished()
-            await asyncio.sleep(1)
-        i += 1
         logger.info(
-            f"Mission finished. Line of sight confirmed to mast: {has_found_mast.is_set()}"
+            f"Mission finished. Line of sight confirmed to mast: {state.has_found_mast.is_set()}"
         )
-        is_returning.clear()
+        state.is_returning.clear()
+        state.obstacle_avoidance_triggered.clear()
         await drone.mission.clear_mission()
-    logger.info("Landing")
-    await drone.action.return_to_launch()
 
+    do_mast_recognition_task.cancel()
+    try:
+        await do_mast_recognition_task
+    except asyncio.CancelledError:
+        pass
+    return state.has_found_mast.is_set()
+
+
+async def return_to_entry(
+    drone: System, state: MissionState, entry_point: Tuple[float, float]
+):
+    logger.info("Returning to base")
+    state.is_returning.set()
+    state.obstacle_avoidance_triggered.clear()
+    await drone.mission.clear_mission()
+    await drone.mission.upload_mission(MissionPlan([entry_mission_item(entry_point)]))
+    await asyncio.sleep(1)
+    await drone.mission.start_mission()
+    is_finished = False
+    while not is_finished:
+        is_finished = await drone.mission.is_mission_finished()
+        await asyncio.sleep(1)
+
+
+def mast_position(mast: Mast) -> Tuple[float, float]:
+    return (
+        float(mast["wgs84koordinat"]["laengde"]),
+        float(mast["wgs84koordinat"]["bredde"]),
+    )
+
+
+def mast_mission_item(mast: Mast) -> MissionItem:
+    return MissionItem(
+        latitude_deg=float(mast["wgs84koordinat"]["bredde"]),
+        longitude_deg=float(mast["wgs84koordinat"]["laengde"]),
+        relative_altitude_m=MAST_HEIGHT,
+        speed_m_s=3,
+        is_fly_through=False,
+        gimbal_pitch_deg=45,
+        gimbal_yaw_deg=float("nan"),
+        camera_action=MissionItem.CameraAction.NONE,
+        loiter_time_s=float("nan"),
+        camera_photo_interval_s=float("nan"),
+        acceptance_radius_m=ACCEPTANCE_RADIUS,
+        yaw_deg=float("nan"),
+        camera_photo_distance_m=float("nan"),
+    )
+
+
+def entry_mission_item(entry_point: Tuple[float, float]) -> MissionItem:
+    return MissionItem(
+        float(entry_point[1]),
+        float(entry_point[0]),
+        MAST_HEIGHT,
+        3,
+        False,
+        float("nan"),
+        float("nan"),
+        MissionItem.CameraAction.NONE,
+        float("nan"),
+        float("nan"),
+        float("nan"),
+        float("nan"),
+        float("nan"),
+    )
 
-async def monitor_distance(drone: System):
+
+async def monitor_mission_progress(drone: System, state: MissionState):
+    async for progress in drone.mission.mission_progress():
+        logger.debug(f"Mission progress: {progress.current}/{progress.total}")
+        state.mission_progress.current = progress.current
+        state.mission_progress.total = progress.total
+
+
+async def monitor_distance(drone: System, state: MissionState):
     logger.debug("Distance monitoring enabled")
+    obstacle = ObstacleFilter(OBSTACLE_WINDOW, OBSTACLE_DISTANCE, OBSTACLE_CLEAR_DISTANCE)
     async for distance in drone.telemetry.distance_sensor():
-        logger.debug(f"Distance from sensor: {distance}")
+        state.telemetry.record(
+            "distance",
+            distance.minimum_distance_m,
+            distance.maximum_distance_m,
+            distance.current_distance_m,
+        )
         if (
-            # For some reason, the documentation is in meters,
-            # but the data we get is certainly not meters.
-            # Therefore, 400 meters here does not equal 400 meters in Gazebo.
-            distance.current_distance_m < 400
-            and mast_height_altitude_reached.is_set()
-            and not is_returning.set()
-            and not await drone.mission.is_mission_finished()
+            obstacle.update(distance.current_distance_m)
+            and state.mast_height_altitude_reached.is_set()
+            and not state.is_returning.is_set()
+            and not state.is_mission_finished()
+            and not state.obstacle_avoidance_triggered.is_set()
         ):
-            obstacle_avoidance_triggered.set()
+            state.obstacle_avoidance_triggered.set()
             logger.info(f"Obstacle identified, line of sight cannot be confirmed.")
     logger.debug("Distance monitoring disabled")
 
 
 @logger.catch
-async def monitor_altitude(drone: System):
+async def monitor_altitude(drone: System, state: MissionState):
     logger.debug("Altitude monitoring enabled")
     async for pos in drone.telemetry.position():
-        logger.debug(f"Drone altitude: {pos.relative_altitude_m}")
         # Add 2 meters to account for sensor data not always being percise.
         if pos.relative_altitude_m + 2 > MAST_HEIGHT:
-            mast_height_altitude_reached.set()
+            state.mast_height_altitude_reached.set()
             logger.info("Mission altitude reached.")
             return
 
 
-async def do_mast_recognition():
+@logger.catch
+async def monitor_position(drone: System, state: MissionState):
+    async for pos in drone.telemetry.position():
+        state.drone_position = (pos.longitude_deg, pos.latitude_deg)
+        state.telemetry.record(
+            "position", pos.longitude_deg, pos.latitude_deg, pos.relative_altitude_m
+        )
+
+
+def recognition_interval(confidence: float, distance: Optional[float]) -> float:
+    """
+    How long to wait before checking the next image in continuous mode.
+
+    Images are checked back-to-back when the last one looked promising, or when
+    the drone is close to the mast (or its position is unknown). Further away,
+    the pause grows with the distance, up to MAX_RECOGNITION_INTERVAL.
+
+    :param confidence: Confidence that the last image contains a mast
+    :param distance: Distance from the drone to the mast in meters, if known
+    """
+    if confidence >= MAST_CONFIDENCE / 2 or distance is None:
+        return 0
+    if distance <= NEAR_MAST_DISTANCE:
+        return 0
+    return min(
+        MAX_RECOGNITION_INTERVAL,
+        MAX_RECOGNITION_INTERVAL * (distance - NEAR_MAST_DISTANCE) / NEAR_MAST_DISTANCE,
+    )
+
+
+async def do_mast_recognition(state: MissionState, continuous: bool = False):
     i = 0  # May be removed, as only 1 image is needded each time.
+    frame_seq = 0  # Sequence number of the last frame that was checked
     logger.debug("Mast recognition called")
-    logger.debug("Has Found Mast: " + str(has_found_mast.is_set()))
-    while not has_found_mast.is_set():
-        if not is_returning.is_set() and mast_height_altitude_reached.is_set():
-            # Capture image every 5 seconds to analyze
-            logger.info("Taking image")
-            img = None
-            while img is None:
-                # Wait for the next frame
-                if not video.frame_available():
-                    continue
-
-                img = video.frame()
-            im = Image.fromarray(img[:, :, ::-1])
-            im = im.resize((224, 224))
-            im.save(f"images/second_{i}.jpeg")
-            if image_contains_mast(img_to_array(im)):
-                has_found_mast.set()
-                logger.info("Mast found! Returning to base.")
+    logger.debug("Has Found Mast: " + str(state.has_found_mast.is_set()))
+    while not state.has_found_mast.is_set():
+        interval = RECOGNITION_INTERVAL
+        if (
+            not state.is_returning.is_set()
+            and state.mast_height_altitude_reached.is_set()
+        ):
+            # Capture image every 5 seconds (or continuously) to analyze
+            logger.log("DEBUG" if continuous else "INFO", "Taking image")
+            # Wait for a frame that has not been checked yet
+            frame_seq, img = await state.video.next_frame(frame_seq)
+            if not continuous:
+                Image.fromarray(img[:, :, ::-1]).save(state.image_path(i))
+            # Predict on the inference thread, so telemetry is handled in the meantime
+            detection = await inference.submit(img, state.name)
+            confidence = detection.confidence if detection else 0
+            distance = None
+            if state.drone_position is not None and state.target_position is not None:
+                distance = haversine(state.drone_position, state.target_position)
+            state.telemetry.record(
+                "inference",
+                frame_seq,
+                detection.confidence if detection else np.nan,
+                distance if distance is not None else np.nan,
+            )
+            if confidence >= MAST_CONFIDENCE:
+                if continuous:
+                    Image.fromarray(img[:, :, ::-1]).save(state.image_path(i))
+                state.has_found_mast.set()
+                logger.info(f"Mast found at {detection.box}! Returning to base.")
             logger.debug("Mast-check completed.")
             i += 1
+            if continuous:
+                interval = recognition_interval(confidence, distance)
         else:
             logger.debug("Mast recognition disabled while returning or taking off.")
-        await asyncio.sleep(5)
+            if continuous:
+                interval = 0.5
+        await asyncio.sleep(interval)
     logger.debug("Exiting mast recognition task")
 
 
 @logger.catch
-def image_contains_mast(im):
+def detect_mast(im: np.ndarray) -> Optional["Detection"]:
+    """Find a mast (a balloon, in the simulation) in a BGR frame"""
     if (
         time.time() - time_start
     ) > 200:  # Cheat, and show the camera a picture of a balloon/mast
-        im = img_to_array(Image.open("../data/balloon.jpg").resize((224, 224)))
-    logger.debug("image_contains_mast called")
-    image = im.reshape((1, im.shape[0], im.shape[1], im.shape[2]))
-    image = preprocess_input(image)
-    pred = model.predict(image)
-    label = decode_predictions(pred)
-    label = label[0][0]
-    logger.debug(
-        "image_contains_mast returned {}, confidence: {}",
-        label[1] == "balloon" and label[2] >= 0.90,
-        label[2],
-    )
-    return label[1] == "balloon" and label[2] >= 0.90
+        im = np.asarray(Image.open("../data/balloon.jpg").convert("RGB"))[:, :, ::-1]
+    if prefilter is not None and not prefilter.passes(im):
+        logger.debug("detect_mast skipped, no vertical structures in the frame")
+        return None
+    logger.debug("detect_mast called")
+    detection = detector.detect(im)
+    logger.debug("detect_mast returned {}", detection)
+    return detection
+
+
+inference = InferenceWorker(detect_mast)
 
 
 async def observe_is_in_air(drone, running_tasks):
@@ -259,8 +556,26 @@ async def observe_is_in_air(drone, running_tasks):
             return
 
 
-def start(lat: float, lon: float):
-    loop = asyncio.get_event_loop().run_until_complete(run((lon, lat)))
+def start(
+    lat: float,
+    lon: float,
+    plan_path: Optional[str] = None,
+    dem_path: Optional[str] = None,
+    continuous: bool = False,
+    state: Optional[MissionState] = None,
+):
+    if state is None:
+        state = MissionState()
+    try:
+        loop = asyncio.get_event_loop().run_until_complete(
+            run((lon, lat), plan_path, dem_path, continuous, state)
+        )
+    finally:
+        state.telemetry.close()
+        if prefilter is not None:
+            logger.info(
+                f"Pre-filter passed {prefilter.passed} of {prefilter.passed + prefilter.rejected} frames to the detector"
+            )
 
 
 if __name__ == "__main__":
@@ -283,10 +598,43 @@ if __name__ == "__main__":
         type=float,
         help=f"The latitude coordinate, default={55.369671}",
     )
+    parser.add_argument(
+        "--plan",
+        metavar="PLAN",
+        action="store",
+        default=None,
+        help="Read the masts to check from a plan made by plan_sites.py, instead of looking them up",
+    )
+    parser.add_argument(
+        "--dem",
+        metavar="GEOTIFF",
+        action="store",
+        default=None,
+        help="Skip masts that an elevation model (a GeoTIFF in longitude/latitude) shows are blocked by the terrain",
+    )
+    parser.add_argument(
+        "--continuous",
+        action="store_true",
+        help="Check images back-to-back, as often as the drone's distance to the mast and the confidence of the last image call for, instead of every 5 seconds",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Only run the detector on frames with tall vertical structures (masts). Do not use in the simulation, where masts are balloons.",
+    )
     config = parser.parse_args()
+    if config.prefilter:
+        from mast_prefilter import MastPrefilter
+
+        prefilter = MastPrefilter()
+    # The telemetry of a mission is stored next to its log, as logs/<time>.telemetry
+    log_path = dirname(realpath(__file__)) + "/../logs/" + datetime.now().strftime(
+        "%Y-%m-%d_%H-%M-%S_%f"
+    )
+    state = MissionState(telemetry=TelemetryRecorder(log_path + ".telemetry"))
     logger.remove(0)
     logger.add(
-        dirname(realpath(__file__)) + "/../logs/{time}.log",
+        log_path + ".log",
         format="{time}\t| {level}\t| {file}:{function}:{line} \t- {message}>",
         level="DEBUG",
         enqueue=True,
@@ -299,4 +647,4 @@ if __name__ == "__main__":
         enqueue=True,
     )
 
-    start(config.lat, config.lon)
+    start(config.lat, config.lon, config.plan, config.dem, config.continuous, state)
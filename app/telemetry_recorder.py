@@ -0,0 +1,151 @@
+import json
+import os
+import time
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+TELEMETRY_VERSION = 1
+
+# The columns of each channel. Every row also has the time t, in seconds since the recorder started.
+CHANNELS = {
+    "position": [
+        ("longitude", "f8"),
+        ("latitude", "f8"),
+        ("relative_altitude", "f4"),
+    ],
+    "distance": [
+        ("minimum_distance", "f4"),
+        ("maximum_distance", "f4"),
+        ("current_distance", "f4"),
+    ],
+    # confidence is nan if nothing was detected, distance_to_mast is nan if unknown
+    "inference": [
+        ("frame", "i8"),
+        ("confidence", "f4"),
+        ("distance_to_mast", "f4"),
+    ],
+}
+
+BATCH_SIZE = 1024  # Rows of a channel kept in memory before they are written
+FLUSH_INTERVAL = 5  # Longest time rows are kept in memory (seconds)
+
+
+def channel_dtype(name: str) -> np.dtype:
+    return np.dtype([("t", "f8"), *CHANNELS[name]])
+
+
+class _Channel:
+    def __init__(self, path: Optional[str], dtype: np.dtype, batch_size: int):
+        self.rows = np.zeros(batch_size, dtype=dtype)
+        self.count = 0
+        self.flushed_at = 0.0
+        self.file = open(path, "ab") if path is not None else None
+
+    def append(self, row: tuple, t: float):
+        self.rows[self.count] = row
+        self.count += 1
+        if self.count == len(self.rows) or t - self.flushed_at > FLUSH_INTERVAL:
+            self.flush(t)
+
+    def flush(self, t: float):
+        if self.file is not None and self.count:
+            self.file.write(self.rows[: self.count].tobytes())
+            self.file.flush()
+        self.count = 0
+        self.flushed_at = t
+
+    def close(self, t: float):
+        self.flush(t)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TelemetryRecorder:
+    """
+    Records telemetry and inference results of a mission at full rate.
+
+    Rows are collected in preallocated NumPy batches, and each full batch is
+    appended to the file of its channel as raw bytes, so recording a message
+    costs about as much as a tuple assignment. The files can be loaded with
+    load_telemetry in one read per channel.
+
+    The recorder is not thread-safe; record from the event loop only.
+
+    :param path: Directory to write to, or None to not write anything (for replays)
+    """
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "meta.json"), "w") as f:
+                json.dump(
+                    {
+                        "version": TELEMETRY_VERSION,
+                        "start": self.start,
+                        "channels": {
+                            name: channel_dtype(name).descr for name in CHANNELS
+                        },
+                    },
+                    f,
+                )
+        self._channels = {
+            name: _Channel(
+                os.path.join(path, f"{name}.bin") if path is not None else None,
+                channel_dtype(name),
+                batch_size,
+            )
+            for name in CHANNELS
+        }
+
+    def record(self, channel: str, *values):
+        """Record a row of a channel, with the values of its columns in order"""
+        t = time.perf_counter() - self._t0
+        self._channels[channel].append((t, *values), t)
+
+    def flush(self):
+        t = time.perf_counter() - self._t0
+        for channel in self._channels.values():
+            channel.flush(t)
+
+    def close(self):
+        t = time.perf_counter() - self._t0
+        for channel in self._channels.values():
+            channel.close(t)
+
+
+class Telemetry(NamedTuple):
+    start: float  # When the recorder started, in seconds since the epoch
+    position: np.ndarray
+    distance: np.ndarray
+    inference: np.ndarray
+
+
+def load_telemetry(path: str) -> Telemetry:
+    """
+    Load the telemetry recorded by a TelemetryRecorder.
+
+    :return: A structured array with the rows of each channel, in the order they were recorded
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("version") != TELEMETRY_VERSION:
+        raise ValueError(
+            f"{path} has telemetry version {meta.get('version')}, expected {TELEMETRY_VERSION}"
+        )
+    channels: Dict[str, np.ndarray] = {}
+    for name in CHANNELS:
+        dtype = np.dtype([tuple(column) for column in meta["channels"][name]])
+        file = os.path.join(path, f"{name}.bin")
+        if not os.path.exists(file):
+            channels[name] = np.zeros(0, dtype=dtype)
+            continue
+        data = np.fromfile(file, dtype=np.uint8)
+        # A batch that was being written when the mission stopped may be cut short
+        data = data[: len(data) - len(data) % dtype.itemsize]
+        channels[name] = data.view(dtype)
+    return Telemetry(start=meta["start"], **channels)
@@ -0,0 +1,42 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+class StartupTimer:
+    """
+    Records when each phase of the startup begins and how long it takes.
+
+    Phases may overlap and run on different threads; the report lists them in
+    the order they started, relative to when the timer was created.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases: List[Tuple[str, float, float]] = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float):
+        """Record a phase from perf_counter timestamps"""
+        with self._lock:
+            self.phases.append((name, start - self.t0, end - start))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def report(self) -> str:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        width = max((len(name) for (name, _, _) in phases), default=0)
+        lines = [
+            f"{name:<{width}}  starts at {start:7.3f} s, takes {duration:7.3f} s"
+            for (name, start, duration) in phases
+        ]
+        lines.append(f"Total startup time: {time.perf_counter() - self.t0:.3f} s")
+        return "\n".join(lines)
@@ -29,11 +29,17 @@ Usage - formats:
 """
 
 import argparse
+import contextlib
 import os
 import platform
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import torch
 
 FILE = Path(__file__).resolve()
@@ -43,9 +49,11 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
-from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
-from utils.general import (LOGGER, Profile, check_file, check_img_size, check_imshow, check_requirements, colorstr, cv2,
-                           increment_path, non_max_suppression, print_args, scale_boxes, strip_optimizer, xyxy2xywh)
+from utils.dataloaders import (IMG_FORMATS, VID_FORMATS, LoadImageBatches, LoadImages, LoadScreenshots,
+                               LoadStreams, PrefetchImages)
+from utils.general import (LOGGER, Profile, Throughput, check_file, check_img_size, check_imshow, check_requirements,
+                           colorstr, cv2, increment_path, non_max_suppression, print_args, save_labels, scale_boxes,
+                           strip_optimizer, xyxy2labels)
 from utils.plots import Annotator, colors, save_one_box
 from utils.torch_utils import select_device, smart_inference_mode
 
@@ -63,6 +71,7 @@ def run(
         view_img=False,  # show results
         save_txt=False,  # save results to *.txt
         save_conf=False,  # save confidences in --save-txt labels
+        save_npz=False,  # save all results to one labels.npz
         save_crop=False,  # save cropped prediction boxes
         nosave=False,  # do not save images/videos
         classes=None,  # filter by class: --class 0, or --class 0 2 3
@@ -79,6 +88,8 @@ def run(
         half=False,  # use FP16 half-precision inference
         dnn=False,  # use OpenCV DNN for ONNX inference
         vid_stride=1,  # video frame-rate stride
+        batch_size=1,  # images per forward pass for file/dir/glob sources
+        workers=0,  # load and write threads for file/dir/glob sources, 0 for sequential
 ):
     source = str(source)
     save_img = not nosave and not source.endswith('.txt')  # save inference images
@@ -101,6 +112,10 @@ def run(
 
     # Dataloader
     bs = 1  # batch_size
+    batched = False  # batches of images from LoadImages
+    pipelined = workers > 0 and not (webcam or screenshot)  # load, infer and write on separate threads
+    if pipelined:
+        stages = Throughput(cuda=False), Throughput(), Throughput(cuda=False)  # load, model, write
     if webcam:
         view_img = check_imshow(warn=True)
         dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
@@ -109,108 +124,172 @@ def run(
         dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
     else:
         dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
+        if pipelined:
+            dataset = PrefetchImages(dataset, workers=workers, prefetch=2 * workers * batch_size, profile=stages[0])
+        if batch_size > 1:
+            dataset = LoadImageBatches(dataset, batch_size=batch_size)
+            batched = True
     vid_path, vid_writer = [None] * bs, [None] * bs
 
+    def process(det, p, im0, frame, mode, s, shape, vid_cap, j, k):
+        # Rescale, print, draw and save the detections on image im0 inferred at shape (h, w), returns the print string
+        # k counts the images in the order they were inferred, which the writer threads may not keep
+        p = Path(p)  # to Path
+        save_path = str(save_dir / p.name)  # im.jpg
+        txt_path = str(save_dir / 'labels' / p.stem) + ('' if mode == 'image' else f'_{frame}')  # im.txt
+        s += '%gx%g ' % shape  # print string
+        imc = im0.copy() if save_crop else im0  # for save_crop
+        annotator = Annotator(im0, line_width=line_thickness, example=str(names))
+        if len(det):
+            # Rescale boxes from img_size to im0 size
+            det[:, :4] = scale_boxes(shape, det[:, :4], im0.shape).round()
+
+            # Print results
+            for c in det[:, 5].unique():
+                n = (det[:, 5] == c).sum()  # detections per class
+                s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
+
+            # Write results
+            if save_txt or save_npz:
+                labels = xyxy2labels(det.flip(0), im0.shape)  # normalized [cls, x, y, w, h, conf]
+                if save_txt:  # Write to file
+                    save_labels(labels, f'{txt_path}.txt', save_conf)
+            for *xyxy, conf, cls in reversed(det):
+                if save_img or save_crop or view_img:  # Add bbox to image
+                    c = int(cls)  # integer class
+                    label = None if hide_labels else (names[c] if hide_conf else f'{names[c]} {conf:.2f}')
+                    annotator.box_label(xyxy, label, color=colors(c, True))
+                if save_crop:
+                    save_one_box(xyxy, imc, file=save_dir / 'crops' / names[c] / f'{p.stem}.jpg', BGR=True)
+
+        if save_npz:  # images without detections too
+            results[k] = str(p), frame, labels if len(det) else np.zeros((0, 6), dtype=np.float32)
+
+        # Stream results
+        im0 = annotator.result()
+        if view_img:
+            if platform.system() == 'Linux' and p not in windows:
+                windows.append(p)
+                cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
+                cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
+            cv2.imshow(str(p), im0)
+            cv2.waitKey(1)  # 1 millisecond
+
+        # Save results (image with detections)
+        if save_img:
+            if mode == 'image':
+                cv2.imwrite(save_path, im0)
+            else:  # 'video' or 'stream'
+                if vid_path[j] != save_path:  # new video
+                    vid_path[j] = save_path
+                    if isinstance(vid_writer[j], cv2.VideoWriter):
+                        vid_writer[j].release()  # release previous video writer
+                    if vid_cap:  # video
+                        fps = vid_cap.get(cv2.CAP_PROP_FPS)
+                        w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                        h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                    else:  # stream
+                        fps, w, h = 30, im0.shape[1], im0.shape[0]
+                    save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
+                    vid_writer[j] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+                vid_writer[j].write(im0)
+        return s
+
+    @smart_inference_mode()  # inference mode is per thread, and det is an inference tensor
+    def write(ms, det, *args):
+        # Writer stage of the pipeline
+        with stages[2]():
+            s = process(det, *args)
+        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{ms:.1f}ms")
+
+    if pipelined:
+        # Images are drawn and saved on a pool, video frames (and shown images) in order on a single thread
+        writers = ThreadPoolExecutor(workers), ThreadPoolExecutor(1)
+        slots = threading.BoundedSemaphore(2 * workers * batch_size)  # images waiting for or in the writers
+        pending = deque()
+
     # Run inference
-    model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
-    seen, windows, dt = 0, [], (Profile(), Profile(), Profile())
+    model.warmup(imgsz=(batch_size if batched else 1 if pt or model.triton else bs, 3, *imgsz))  # warmup
+    seen, windows, results, t0 = 0, [], {}, time.time()  # results of image k for labels.npz
+    dt = (contextlib.nullcontext(),) * 3 if pipelined else (Profile(), Profile(), Profile())  # stages time themselves
     for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
-            im = torch.from_numpy(im).to(model.device)
-            im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
-            im /= 255  # 0 - 255 to 0.0 - 1.0
-            if len(im.shape) == 3:
-                im = im[None]  # expand for batch dim
-
-        # Inference
-        with dt[1]:
-            visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
-            pred = model(im, augment=augment, visualize=visualize)
-
-        # NMS
-        with dt[2]:
-            pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+        with stages[1](len(im) if batched else 1) if pipelined else contextlib.nullcontext():
+            with dt[0]:
+                im = torch.from_numpy(im).to(model.device)
+                im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
+                im /= 255  # 0 - 255 to 0.0 - 1.0
+                if len(im.shape) == 3:
+                    im = im[None]  # expand for batch dim
+
+            # Inference
+            with dt[1]:
+                visualize = increment_path(save_dir / Path(path[0] if batched else path).stem,
+                                           mkdir=True) if visualize else False
+                pred = model(im, augment=augment, visualize=visualize)
+
+            # NMS
+            with dt[2]:
+                pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
 
         # Second-stage classifier (optional)
         # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
 
         # Process predictions
+        strings = s if batched else None  # print string per image of a batch
+        ms = (stages[1].dt if pipelined else dt[1].dt) * 1E3 / len(pred)  # inference time per image
         for i, det in enumerate(pred):  # per image
             seen += 1
             if webcam:  # batch_size >= 1
                 p, im0, frame = path[i], im0s[i].copy(), dataset.count
                 s += f'{i}: '
+            elif batched:  # batch_size >= 1, images of one shape
+                p, im0, frame, s = path[i], im0s[i].copy(), dataset.frames[i], strings[i]
             else:
                 p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
 
-            p = Path(p)  # to Path
-            save_path = str(save_dir / p.name)  # im.jpg
-            txt_path = str(save_dir / 'labels' / p.stem) + ('' if dataset.mode == 'image' else f'_{frame}')  # im.txt
-            s += '%gx%g ' % im.shape[2:]  # print string
-            gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
-            imc = im0.copy() if save_crop else im0  # for save_crop
-            annotator = Annotator(im0, line_width=line_thickness, example=str(names))
-            if len(det):
-                # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
-
-                # Print results
-                for c in det[:, 5].unique():
-                    n = (det[:, 5] == c).sum()  # detections per class
-                    s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
-
-                # Write results
-                for *xyxy, conf, cls in reversed(det):
-                    if save_txt:  # Write to file
-                        xywh = (xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()  # normalized xywh
-                        line = (cls, *xywh, conf) if save_conf else (cls, *xywh)  # label format
-                        with open(f'{txt_path}.txt', 'a') as f:
-                            f.write(('%g ' * len(line)).rstrip() % line + '\n')
-
-                    if save_img or save_crop or view_img:  # Add bbox to image
-                        c = int(cls)  # integer class
-                        label = None if hide_labels else (names[c] if hide_conf else f'{names[c]} {conf:.2f}')
-                        annotator.box_label(xyxy, label, color=colors(c, True))
-                    if save_crop:
-                        save_one_box(xyxy, imc, file=save_dir / 'crops' / names[c] / f'{p.stem}.jpg', BGR=True)
-
-            # Stream results
-            im0 = annotator.result()
-            if view_img:
-                if platform.system() == 'Linux' and p not in windows:
-                    windows.append(p)
-                    cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
-                    cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
-                cv2.imshow(str(p), im0)
-                cv2.waitKey(1)  # 1 millisecond
-
-            # Save results (image with detections)
-            if save_img:
-                if dataset.mode == 'image':
-                    cv2.imwrite(save_path, im0)
-                else:  # 'video' or 'stream'
-                    if vid_path[i] != save_path:  # new video
-                        vid_path[i] = save_path
-                        if isinstance(vid_writer[i], cv2.VideoWriter):
-                            vid_writer[i].release()  # release previous video writer
-                        if vid_cap:  # video
-                            fps = vid_cap.get(cv2.CAP_PROP_FPS)
-                            w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                            h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                        else:  # stream
-                            fps, w, h = 30, im0.shape[1], im0.shape[0]
-                        save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
-                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
-                    vid_writer[i].write(im0)
+            # One writer per stream, LoadImages reads one video at a time
+            args = det, p, im0, frame, dataset.mode, s, im.shape[2:], vid_cap, i if webcam else 0, seen - 1
+            if pipelined:
+                slots.acquire()
+                future = writers[dataset.mode != 'image' or view_img].submit(write, ms, *args)
+                future.add_done_callback(lambda _: slots.release())
+                pending.append(future)
+                while pending and pending[0].done():
+                    pending.popleft().result()  # raise writer errors
+            else:
+                s = process(*args)
+
+                # Print time (inference-only, shared by the images of a batch)
+                if batched:
+                    LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{ms:.1f}ms")
 
         # Print time (inference-only)
-        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
+        if not (batched or pipelined):
+            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
 
     # Print results
-    t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
-    LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
-    if save_txt or save_img:
+    if pipelined:
+        for w in writers:
+            w.shutdown(wait=True)
+        for future in pending:
+            future.result()  # raise writer errors
+        t = tuple(x.rate for x in stages) + (seen / (time.time() - t0),)  # images per second
+        LOGGER.info(f'Throughput: %.1f load, %.1f model, %.1f write images/s per thread, %.1f images/s overall '
+                    f'with {workers} workers at shape {(batch_size, 3, *imgsz)}' % t)
+    else:
+        t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
+        LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape '
+                    f'{(batch_size if batched else 1, 3, *imgsz)}' % t)
+    if save_npz:  # labels of image k are labels[sum(counts[:k]):sum(counts[:k + 1])]
+        files, frames, labels = zip(*(results[k] for k in sorted(results))) if results else ((), (), ())
+        np.savez(save_dir / 'labels.npz',
+                 files=np.array(files, dtype=str),
+                 frames=np.array(frames, dtype=np.int64),
+                 counts=np.array([len(x) for x in labels], dtype=np.int64),
+                 labels=np.concatenate(labels) if labels else np.zeros((0, 6), dtype=np.float32))
+    if save_txt or save_img or save_npz:
         s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ''
+        s += f"\n{len(results)} images of labels saved to {save_dir / 'labels.npz'}" if save_npz else ''
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
     if update:
         strip_optimizer(weights[0])  # update model (to fix SourceChangeWarning)
@@ -229,6 +308,7 @@ def parse_opt():
     parser.add_argument('--view-img', action='store_true', help='show results')
     parser.add_argument('--save-txt', action='store_true', help='save results to *.txt')
     parser.add_argument('--save-conf', action='store_true', help='save confidences in --save-txt labels')
+    parser.add_argument('--save-npz', action='store_true', help='save all results to one labels.npz')
     parser.add_argument('--save-crop', action='store_true', help='save cropped prediction boxes')
     parser.add_argument('--nosave', action='store_true', help='do not save images/videos')
     parser.add_argument('--classes', nargs='+', type=int, help='filter by class: --classes 0, or --classes 0 2 3')
@@ -245,6 +325,8 @@ def parse_opt():
     parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
     parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
     parser.add_argument('--vid-stride', type=int, default=1, help='video frame-rate stride')
+    parser.add_argument('--batch-size', type=int, default=1, help='images per forward pass for file/dir/glob sources')
+    parser.add_argument('--workers', type=int, default=0, help='load and write threads for file/dir/glob sources')
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -15,7 +15,8 @@ import time
 from itertools import repeat
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
-from threading import Thread
+from queue import Full, Queue
+from threading import Event, Thread
 from urllib.parse import urlparse
 
 import numpy as np
@@ -266,6 +267,7 @@ class LoadImages:
         self.auto = auto
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.decode = True  # False returns image paths and raw video frames, for PrefetchImages to load
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -304,18 +306,23 @@ class LoadImages:
         else:
             # Read image
             self.count += 1
+            s = f'image {self.count}/{self.nf} {path}: '
+            if not self.decode:
+                return path, None, None, self.cap, s
             im0 = cv2.imread(path)  # BGR
             assert im0 is not None, f'Image Not Found {path}'
-            s = f'image {self.count}/{self.nf} {path}: '
 
-        if self.transforms:
-            im = self.transforms(im0)  # transforms
-        else:
-            im = letterbox(im0, self.img_size, stride=self.stride, auto=self.auto)[0]  # padded resize
-            im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-            im = np.ascontiguousarray(im)  # contiguous
+        if not self.decode:
+            return path, None, im0, self.cap, s
+        return path, self.preprocess(im0), im0, self.cap, s
 
-        return path, im, im0, self.cap, s
+    def preprocess(self, im0):
+        # Transform or letterbox a BGR image into the model input
+        if self.transforms:
+            return self.transforms(im0)  # transforms
+        im = letterbox(im0, self.img_size, stride=self.stride, auto=self.auto)[0]  # padded resize
+        im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return np.ascontiguousarray(im)  # contiguous
 
     def _new_video(self, path):
         # Create a new video capture object
@@ -339,6 +346,109 @@ class LoadImages:
         return self.nf  # number of files
 
 
+class VideoInfo:
+    # Properties of a cv2.VideoCapture read on the reading thread, still valid once the capture is released
+    props = cv2.CAP_PROP_FPS, cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FRAME_COUNT
+
+    def __init__(self, cap):
+        self.values = {p: cap.get(p) for p in self.props}
+
+    def get(self, prop):
+        return self.values[prop]  # like cap.get(prop)
+
+
+class PrefetchImages:
+    # Reads and letterboxes LoadImages images on a thread pool ahead of the model, i.e. `python detect.py --workers 4`
+    # Returns the VideoInfo of each video in place of its capture
+    def __init__(self, dataset, workers=4, prefetch=16, profile=None):
+        self.dataset = dataset
+        self.workers = workers
+        self.prefetch = prefetch  # most images loading or loaded ahead of the consumer
+        self.profile = profile  # optional Throughput of the loading threads
+        self.mode, self.frame = dataset.mode, 0  # mode and video frame of the last image returned
+
+    def __iter__(self):
+        queue, stop = Queue(maxsize=self.prefetch), Event()
+        pool = ThreadPool(self.workers)
+        Thread(target=self._produce, args=(pool, queue, stop), daemon=True).start()
+        try:
+            while True:
+                item = queue.get()
+                if item is None:  # done
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                result, self.mode, self.frame = item
+                yield result.get()
+        finally:
+            stop.set()
+            pool.terminate()
+
+    def _produce(self, pool, queue, stop):
+        # Walk the dataset in order on one thread, the decoding and letterboxing runs on the pool
+        def put(item):
+            while not stop.is_set():
+                with contextlib.suppress(Full):
+                    queue.put(item, timeout=0.1)
+                    return True
+            return False
+
+        self.dataset.decode = False
+        cap, info = None, None
+        try:
+            for path, _, im0, c, s in self.dataset:
+                if c is not cap:  # new video, read its properties before it is released
+                    cap, info = c, None if c is None else VideoInfo(c)
+                result = pool.apply_async(self._load, (path, im0, info, s))
+                if not put((result, self.dataset.mode, getattr(self.dataset, 'frame', 0))):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        finally:
+            self.dataset.decode = True
+        put(None)
+
+    def _load(self, path, im0, cap, s):
+        with self.profile() if self.profile else contextlib.nullcontext():
+            if im0 is None:
+                im0 = cv2.imread(path)  # BGR
+                assert im0 is not None, f'Image Not Found {path}'
+            return path, self.dataset.preprocess(im0), im0, cap, s
+
+    def __len__(self):
+        return len(self.dataset)  # number of files
+
+
+class LoadImageBatches:
+    # Batches of consecutive same-shape images from LoadImages, i.e. `python detect.py --source path/ --batch-size 8`
+    def __init__(self, dataset, batch_size=8):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.mode = dataset.mode  # mode of the current batch, 'image' or 'video'
+        self.frames = []  # video frame of each image in the current batch
+
+    def __iter__(self):
+        batch, key = [], None
+        for path, im, im0, cap, s in self.dataset:
+            k = (im.shape, self.dataset.mode, cap)  # a batch never mixes shapes, modes or videos
+            if batch and (k != key or len(batch) == self.batch_size):
+                yield self._collate(batch)
+                batch = []
+            key = k
+            batch.append((path, im, im0, cap, s, getattr(self.dataset, 'frame', 0), self.dataset.mode))
+        if batch:
+            yield self._collate(batch)
+
+    def _collate(self, batch):
+        paths, ims, im0s, caps, ss, self.frames, modes = zip(*batch)
+        self.mode = modes[0]
+        return list(paths), np.stack(ims), list(im0s), caps[0], list(ss)
+
+    def __len__(self):
+        return len(self.dataset)  # number of files
+
+
 class LoadStreams:
     # YOLOv5 streamloader, i.e. `python detect.py --source 'rtsp://example.com/media.mp4'  # RTSP, RTMP, HTTP streams`
     def __init__(self, sources='file.streams', img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
@@ -15,6 +15,7 @@ import random
 import re
 import signal
 import sys
+import threading
 import time
 import urllib
 from copy import deepcopy
@@ -180,6 +181,45 @@ class Profile(contextlib.ContextDecorator):
         return time.time()
 
 
+class Throughput:
+    # YOLOv5 Throughput class, a thread-safe Profile that also counts items. Usage: 'with Throughput()(n):' for n items
+    def __init__(self, cuda=True):
+        self.t = 0.0  # busy time, summed over threads
+        self.n = 0  # items
+        self.cuda = cuda and torch.cuda.is_available()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __call__(self, n=1):
+        self.local.n = n  # items handled in the next 'with' block of this thread
+        return self
+
+    def __enter__(self):
+        self.local.start = self.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        dt = self.time() - self.local.start
+        self.local.dt = dt  # delta-time of this thread
+        with self.lock:
+            self.t += dt
+            self.n += getattr(self.local, 'n', 1)
+        self.local.n = 1
+
+    @property
+    def dt(self):
+        return getattr(self.local, 'dt', 0.0)
+
+    @property
+    def rate(self):
+        return self.n / self.t if self.t else 0.0  # items per second of one thread
+
+    def time(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.time()
+
+
 class Timeout(contextlib.ContextDecorator):
     # YOLOv5 Timeout class. Usage: @Timeout(seconds) decorator or 'with Timeout(seconds):' context manager
     def __init__(self, seconds, *, timeout_msg='', suppress_timeout_errors=True):
@@ -789,6 +829,23 @@ def xyxy2xywhn(x, w=640, h=640, clip=False, eps=0.0):
     return y
 
 
+def xyxy2labels(det, shape):
+    # Convert nx6 detections [x1, y1, x2, y2, conf, cls] on an image of shape (h, w) to nx6 labels [cls, x, y, w, h, conf]
+    # with normalized xywh, all at once
+    det = det.cpu().numpy() if isinstance(det, torch.Tensor) else np.asarray(det)
+    h, w = shape[:2]
+    return np.concatenate((det[:, 5:6], xyxy2xywhn(det[:, :4], w=w, h=h), det[:, 4:5]), 1)
+
+
+def save_labels(labels, file, save_conf=False):
+    # Append nx6 labels [cls, x, y, w, h, conf] to a *.txt file in a single write, no file if there are none
+    if len(labels):
+        rows = labels if save_conf else labels[:, :5]
+        fmt = ('%g ' * rows.shape[1]).rstrip() + '\n'
+        with open(file, 'a') as f:
+            f.write(''.join(fmt % tuple(row) for row in rows.tolist()))
+
+
 def xyn2xy(x, w=640, h=640, padw=0, padh=0):
     # Convert normalized segments into pixel segments, shape (n,2)
     y = x.clone() if isinstance(x, torch.Tensor) else np.copy(x)